@@ -2,13 +2,13 @@
 
 from __future__ import annotations
 
-import struct
 from datetime import datetime
 
 import flask
 from flask import Blueprint, jsonify
 
-from drbg import HMACDRBG
+from drbg import HMACDRBG, SharedHMACDRBG
+from responses import INDEX_MAX_AGE_SECONDS
 
 audio_bp = Blueprint(
     "audio",
@@ -19,6 +19,9 @@ audio_bp = Blueprint(
 
 _ENTROPY = b"asdfasdgsadg"
 
+# Gaps need not be reproducible per seed.
+_GAP_RNG = SharedHMACDRBG(_ENTROPY)
+
 
 def _build_drbg(seed: str, salt: bytes) -> HMACDRBG:
     seed_bytes = seed.encode("utf-8")
@@ -32,7 +35,9 @@ def _build_drbg(seed: str, salt: bytes) -> HMACDRBG:
 @audio_bp.route("/")
 def index() -> flask.Response:
     """Serve the streamlined audio stability UI."""
-    return flask.send_file("Audio/index.html")
+    return flask.send_from_directory(
+        audio_bp.root_path, "index.html", max_age=INDEX_MAX_AGE_SECONDS
+    )
 
 
 @audio_bp.route(
@@ -58,13 +63,11 @@ def get_snippets_config(
     min_frequency = max(1, min_frequency)
     max_frequency = max(min_frequency, max_frequency)
 
-    # Use a rapidly changing nonce for gaps and a slower one for frequencies to avoid reuse
-    now_ts = datetime.now().timestamp()
-    gap_rng = _build_drbg(seed, salt=struct.pack("d", float(now_ts)))
+    # Frequencies are reproducible per seed within a month; gaps are not.
     freq_rng = _build_drbg(seed, salt=datetime.now().strftime("%Y-%m").encode("utf-8"))
 
-    gaps = [gap_rng.randint(min_length, max_length) for _ in range(max(0, n - 1))]
-    frequencies = [freq_rng.randint(min_frequency, max_frequency) for _ in range(n)]
+    gaps = _GAP_RNG.randints(min_length, max_length, n - 1)
+    frequencies = freq_rng.randints(min_frequency, max_frequency, n)
 
     return jsonify(
         {
@@ -1,17 +1,24 @@
-import base64
+import binascii
 import hashlib
 import io
+import logging
 import os
 import string
-import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Tuple
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
 
 import flask
+import numpy as np
 from PIL import Image
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 
-from drbg import HMACDRBG
+from drbg import HMACDRBG, SharedHMACDRBG
+from responses import INDEX_MAX_AGE_SECONDS
 
 canvas_bp = Blueprint(
     "canvas",
@@ -22,15 +29,41 @@ canvas_bp = Blueprint(
 
 # Matches the standalone canvas_server entropy to keep identical behaviour.
 entropy = b"0\x01\xe5`\xf1&\xf1\x93\xab\x10Ol\x0ezw^\xea}\xe2#\xc4\xd8s^\x1bk\x0c\xcd\x07S\x08\r"
-print(entropy)
+# Row positions need not be reproducible per seed.
+_POSITION_RNG = SharedHMACDRBG(entropy)
 
 # Store draw configurations keyed by seed bytes so the upload route can reuse them.
-db = {}
+# Entries expire after CHALLENGE_TTL_SECONDS; past MAX_CHALLENGES the oldest go first.
+CHALLENGE_TTL_SECONDS = 600
+MAX_CHALLENGES = 10_000
+db: "OrderedDict[bytes, Tuple[float, tuple]]" = OrderedDict()
+_db_lock = threading.Lock()
 
 # Ensure debug crops can be written just like the reference server.
 _UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload")
 os.makedirs(_UPLOAD_DIR, exist_ok=True)
 
+# Row crops are hashed concurrently; PIL crops and hashlib release the GIL.
+_HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="canvas-hash")
+
+# Vertical extent of each text row crop relative to its baseline y.
+FONT_SIZE = 20
+TOP_PADDING = 4
+BOTTOM_PADDING = 10
+
+
+_MAIN_CHARS = (
+    string.ascii_uppercase
+    + string.ascii_lowercase
+    + string.digits
+    + "!@#$%^&*()-_=+[]{};:,.<>/? "
+)
+# byte value -> ASCII code of _MAIN_CHARS[value % len(_MAIN_CHARS)]
+_MAIN_CHAR_TABLE = bytes(
+    ord(_MAIN_CHARS[value % len(_MAIN_CHARS)]) for value in range(256)
+)
+_EMOJIS = ["😀", "😎", "🚀", "🔥", "✨", "💡", "✅", "🎉", "❤️", "🐍"]
+
 
 def map_bytes_to_string(data: bytes, num_emojis: int = 1) -> str:
     """
@@ -43,19 +76,9 @@ def map_bytes_to_string(data: bytes, num_emojis: int = 1) -> str:
     if num_emojis < 0 or num_emojis > len(data):
         raise ValueError("num_emojis must be between 0 and len(data)")
 
-    uppercase = string.ascii_uppercase
-    lowercase = string.ascii_lowercase
-    specials = string.digits + "!@#$%^&*()-_=+[]{};:,.<>/? "
-    main_chars = uppercase + lowercase + specials
-    emojis = ["😀", "😎", "🚀", "🔥", "✨", "💡", "✅", "🎉", "❤️", "🐍"]
-
-    result = []
     cutoff = len(data) - num_emojis
-    for b in data[:cutoff]:
-        result.append(main_chars[b % len(main_chars)])
-    for b in data[cutoff:]:
-        result.append(emojis[b % len(emojis)])
-    return "".join(result)
+    main_part = bytes(data[:cutoff]).translate(_MAIN_CHAR_TABLE).decode("ascii")
+    return main_part + "".join(_EMOJIS[b % len(_EMOJIS)] for b in data[cutoff:])
 
 
 def tighten_image(img: Image.Image, threshold: int = 245) -> Image.Image:
@@ -73,53 +96,87 @@ def tighten_image(img: Image.Image, threshold: int = 245) -> Image.Image:
             return img.crop(bbox)
 
     rgb_img = img.convert("RGB")
-    gray = rgb_img.convert("L")
     # Anything darker than the threshold is considered foreground.
-    mask = gray.point(lambda px: 255 if px < threshold else 0)
-    bbox = mask.getbbox()
-    return rgb_img.crop(bbox) if bbox else rgb_img
+    mask = np.asarray(rgb_img.convert("L")) < threshold
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not rows.size:
+        return rgb_img
+    cols = np.flatnonzero(mask.any(axis=0))
+    bbox = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+    return rgb_img.crop(bbox)
+
+
+def sha256_image(img: Image.Image) -> str:
+    """SHA-256 of the raw pixel data of `img`."""
+    # Row crops are at most ~34 px tall, so one tobytes() buffer is the cheapest input.
+    return hashlib.sha256(img.tobytes()).hexdigest()
+
+
+def _evict_challenges_locked(now: float) -> None:
+    """Drop expired or overflowing challenges, oldest first (call under _db_lock)."""
+    while db:
+        seed_bytes, (stored_at, _) = next(iter(db.items()))
+        if len(db) <= MAX_CHALLENGES and now - stored_at <= CHALLENGE_TTL_SECONDS:
+            break
+        del db[seed_bytes]
+
+
+def _store_challenge(seed_bytes: bytes, challenge: tuple) -> None:
+    now = time.monotonic()
+    with _db_lock:
+        db[seed_bytes] = (now, challenge)
+        db.move_to_end(seed_bytes)
+        _evict_challenges_locked(now)
+
+
+def _load_challenge(seed_bytes: bytes) -> Optional[tuple]:
+    """Return the stored challenge for the seed, or None if missing or expired."""
+    now = time.monotonic()
+    with _db_lock:
+        _evict_challenges_locked(now)
+        entry = db.get(seed_bytes)
+        return entry[1] if entry is not None else None
+
+
+def _hash_row(img: Image.Image, top: int, bottom: int) -> str:
+    """Crop one text row out of a fully loaded image, tighten it and hash it."""
+    cropped_img = img.crop((0, top, img.width, min(img.height, bottom)))
+    return sha256_image(tighten_image(cropped_img))
 
 
 @canvas_bp.route("/")
 def index():
-    return flask.send_file("Canvas/index.html")
+    return flask.send_from_directory(
+        canvas_bp.root_path, "index.html", max_age=INDEX_MAX_AGE_SECONDS
+    )
 
 
 @canvas_bp.route("/get_string_config/<string:seed>/<int:n>/<int:width>/<int:height>")
 def get_string_config(seed: str, n: int, width: int, height: int):
     seed_bytes = seed.encode("utf-8")
-    drbg_positions = HMACDRBG(
-        entropy_input=entropy,
-        nonce=struct.pack("d", float(datetime.now().timestamp())),
-        personalization_string=seed_bytes,
-    )
     drbg_strings = HMACDRBG(
         entropy_input=entropy,
         nonce=datetime.now().strftime("%Y-%m").encode("utf-8"),
         personalization_string=seed_bytes,
     )
 
-    strings: List[str] = []
-    xs: List[int] = []
-    ys: List[int] = []
-    y_cursor = 25
+    # Draw all positions in two batched DRBG calls instead of per-row randint.
+    xs: List[int] = _POSITION_RNG.randints(2, width - 32 * 30, n)
+    ys: List[int] = list(accumulate(_POSITION_RNG.randints(40, 100, n), initial=25))[1:]
+    strings: List[str] = [
+        map_bytes_to_string(drbg_strings.generate(32), 1) for _ in range(n)
+    ]
 
-    for _ in range(n):
-        x = drbg_positions.randint(2, width - 32 * 30)
-        delta_y = drbg_positions.randint(40, 100)
-        y_cursor += delta_y
-        xs.append(x)
-        ys.append(y_cursor)
-        strings.append(map_bytes_to_string(drbg_strings.generate(32), 1))
-
-    db[seed_bytes] = (strings, xs, ys)
+    # Crop rows are fixed by the config, so resolve them now rather than per upload.
+    crops = [(max(0, y - TOP_PADDING), y + FONT_SIZE + BOTTOM_PADDING) for y in ys]
+    _store_challenge(seed_bytes, (strings, xs, ys, crops))
     return jsonify({"strings": strings, "xs": xs, "ys": ys, "font": "20px Arial"})
 
 
 @canvas_bp.route("/upload_img/<string:seed>", methods=["POST"])
 def upload_img(seed: str):
     seed_bytes = seed.encode("utf-8")
-    challenge = db.get(seed_bytes)
+    challenge = _load_challenge(seed_bytes)
     if challenge is None:
         return jsonify({"error": "Seed not found"}), 404
 
@@ -133,25 +190,24 @@ def upload_img(seed: str):
         return jsonify({"error": "Invalid data URL"}), 400
 
     try:
-        raw_bytes = base64.b64decode(encoded)
-        img = Image.open(io.BytesIO(raw_bytes))
-
+        # a2b_base64 takes the ASCII str directly, skipping b64decode's encode() copy.
+        raw_bytes = binascii.a2b_base64(encoded)
+        # The client always sends canvas.toDataURL("image/png"); skip probing
+        # every other Pillow format plugin and go straight to the PNG decoder.
+        with Image.open(io.BytesIO(raw_bytes), formats=("PNG",)) as img:
+            img.load()  # decode once up front; worker threads only read pixels
+        # Leaving the block detaches the source buffer, so only the bitmap remains.
+        del raw_bytes, encoded
     except Exception as exc:  # noqa: BLE001
         return jsonify({"error": f"Invalid image data: {exc}"}), 400
 
-    strings, xs, ys = challenge
-    hashes: List[str] = []
-    FONT_SIZE = 20
-    TOP_PADDING = 4
-    BOTTOM_PADDING = 10
-    for string_val, x_pos, y_pos in zip(strings, xs, ys):
-        top = max(0, y_pos - TOP_PADDING)
-        bottom = min(img.height, y_pos + FONT_SIZE + BOTTOM_PADDING)
-        cropped_img = img.crop((0, top, img.width, bottom))
-        tightened_img = tighten_image(cropped_img)
-        hash_value = hashlib.sha256(tightened_img.tobytes()).hexdigest()
-        hashes.append(hash_value)
-        print(string_val, hash_value)
+    strings, _, _, crops = challenge
+    hashes: List[str] = list(
+        _HASH_POOL.map(lambda bounds: _hash_row(img, *bounds), crops)
+    )
+    if current_app.logger.isEnabledFor(logging.DEBUG):
+        for string_val, hash_value in zip(strings, hashes):
+            current_app.logger.debug("%s %s", string_val, hash_value)
 
     final_hash = hashlib.sha256("".join(sorted(hashes)).encode()).hexdigest()
     return jsonify({"message": "Image uploaded successfully", "hash": final_hash})
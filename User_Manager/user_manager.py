@@ -1,6 +1,9 @@
-import os, json, threading, tempfile, time
+import atexit, copy, json, logging, os, re, sqlite3, threading, tempfile, time
+from functools import lru_cache
+import orjson
 from werkzeug.security import generate_password_hash, check_password_hash
-from copy import deepcopy
+
+logger = logging.getLogger(__name__)
 
 # Data paths
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
@@ -9,16 +12,73 @@ USERS_DIR = os.path.join(DATA_DIR, 'users')
 os.makedirs(USERS_DIR, exist_ok=True)
 LEGACY_USERS_FILE = os.path.join(DATA_DIR, 'users.json')
 
+# Stability histories keep the newest MAX_HISTORY entries in the user file;
+# once ARCHIVE_BATCH more have piled up, the older ones are moved to the
+# `stability` table of a WAL-mode SQLite archive in one go.
+MAX_HISTORY = 500
+ARCHIVE_BATCH = 50
+STABILITY_DB_PATH = os.path.join(DATA_DIR, 'stability.db')
+
+# Same layout as json.dump(..., ensure_ascii=False, indent=2), but orjson
+# writes exponents without "+" (1e16), stores NaN/Infinity as null and
+# rejects ints wider than 64 bits, so payloads are checked with
+# _is_storable before they are accepted. On the read side orjson turns such
+# ints into floats without complaint, and rejects NaN/Infinity, so files that
+# may hold either (written by json.dump) are parsed with json instead; a
+# record holding a wide int is then written back with json as well.
+_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+# Any 19+ digit run may be an int outside orjson's 64-bit range (false hits,
+# e.g. inside strings, only cost a slower parse).
+_LONG_DIGITS = re.compile(rb"\d{19}")
+
 # Concurrency locks
-_users_lock = threading.Lock()
+_users_lock = threading.Lock()  # directory-level changes (registration, listing)
 _init_lock = threading.Lock()
+# Per-user file locks, striped by lowercase username so arbitrary names
+# (e.g. from failed logins) do not grow a lock table. Never hold two at once.
+_USER_LOCK_STRIPES = 64
+_user_locks = tuple(threading.Lock() for _ in range(_USER_LOCK_STRIPES))
 _storage_initialized = False
 
+# Write-through record cache: path -> ((st_mtime_ns, st_size), record).
+# Entries are read and replaced under the owning user's lock.
+_user_cache = {}
+
+# Shared archive connection; sqlite3 objects are not thread-safe on their own.
+_stability_db = None
+_stability_db_lock = threading.Lock()
+
+# Deferred writes: path -> username of records mutated in the cache but not
+# yet written. A background writer rewrites each dirty file once per
+# WRITE_BATCH_DELAY window, however many appends landed in it. Failed
+# writes stay queued (and cached) and are retried after WRITE_RETRY_DELAY.
+# _pending_mutators keeps the mutators applied since the last write (path ->
+# list, touched under the user's lock) so they can be replayed if the file is
+# changed outside this process before the flush.
+WRITE_BATCH_DELAY = 0.05
+WRITE_RETRY_DELAY = 1.0
+_pending_writes = {}
+_pending_mutators = {}
+_pending_lock = threading.Lock()
+_pending_event = threading.Event()
+_writer_thread = None
+
+# Case-insensitive lookup: lowercase username -> canonical file base name.
+_name_index = {}
+_name_index_mtime = None
+_name_index_lock = threading.Lock()
+
 
 # ---------------------------
 # Basic file operations
 # ---------------------------
 
+@lru_cache(maxsize=1024)
+def _normalize_username(username):
+    """Canonical form used for every username argument (None -> "")."""
+    return (username or "").strip()
+
+
 def _ensure_storage_initialized():
     """Migrate legacy aggregated storage to per-user files once."""
     global _storage_initialized
@@ -29,8 +89,8 @@ def _ensure_storage_initialized():
             return
         if os.path.exists(LEGACY_USERS_FILE):
             try:
-                with open(LEGACY_USERS_FILE, 'r', encoding='utf-8') as f:
-                    legacy_data = json.load(f)
+                with open(LEGACY_USERS_FILE, 'rb') as f:
+                    legacy_data = orjson.loads(f.read())
                 if isinstance(legacy_data, list):
                     for entry in legacy_data:
                         if isinstance(entry, dict) and entry.get("username"):
@@ -46,15 +106,29 @@ def _ensure_storage_initialized():
         _storage_initialized = True
 
 
-def _write_user_atomic(path, user_data):
-    """Atomically write a single user file."""
+def _write_user_atomic(path, user_data, *, fsync=True, exclusive=False):
+    """
+    Atomically write a single user file.
+    With fsync=False the write relies on os.replace atomicity only and skips
+    the disk-sync barrier (used for high-frequency telemetry appends).
+    With exclusive=True the file is published via os.link, which raises
+    FileExistsError instead of overwriting an existing user.
+    """
     fd, tmp_path = tempfile.mkstemp(dir=USERS_DIR, prefix='user_', suffix='.tmp')
     try:
-        with os.fdopen(fd, 'w', encoding='utf-8') as f:
-            json.dump(user_data, f, ensure_ascii=False, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        os.replace(tmp_path, path)
+        with os.fdopen(fd, 'wb') as f:
+            try:
+                f.write(orjson.dumps(user_data, option=_JSON_OPTIONS))
+            except orjson.JSONEncodeError:
+                # Wide ints from a json-parsed legacy file; keep them exact.
+                f.write(json.dumps(user_data, ensure_ascii=False, indent=2).encode())
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if exclusive:
+            os.link(tmp_path, path)
+        else:
+            os.replace(tmp_path, path)
     finally:
         if os.path.exists(tmp_path):
             try:
@@ -66,13 +140,99 @@ def _write_user_atomic(path, user_data):
 def _load_user_file(path):
     """Load a single user file and ensure a dict response."""
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data if isinstance(data, dict) else {}
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if _LONG_DIGITS.search(raw):
+            data = json.loads(raw)  # orjson would read wide ints as floats
+        else:
+            try:
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                # Files written by json.dump may hold NaN/Infinity, which orjson rejects.
+                data = json.loads(raw)
+        return data if isinstance(data, dict) else {}
     except Exception:
         return {}
 
 
+def _is_storable(payload):
+    """Whether orjson can write `payload` (it raises on ints wider than 64 bits)."""
+    try:
+        orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        return False
+    return True
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _load_user_cached(path):
+    """
+    Return the cached record for path, reloading it if the file changed on disk.
+    Callers must hold the user's lock and must not hand the dict out unguarded.
+    """
+    try:
+        signature = _file_signature(path)
+    except FileNotFoundError:
+        _user_cache.pop(path, None)
+        _pending_mutators.pop(path, None)
+        return {}
+    cached = _user_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    record = _load_user_file(path)
+    replay = _pending_mutators.get(path) if cached is not None else None
+    if replay:
+        # Edited outside this process while appends were still queued: apply
+        # them again on top of the new contents instead of dropping them.
+        if not record:
+            logger.warning("Unreadable outside edit of %s; keeping queued record", path)
+            _user_cache[path] = (signature, cached[1])
+            return cached[1]
+        record.setdefault("username", cached[1].get("username"))
+        write_now = False
+        for mutator in replay:
+            try:
+                write_now = bool(mutator(record)) or write_now
+            except Exception:
+                logger.exception("Replaying a queued update of %s failed", path)
+        _user_cache[path] = (signature, record)
+        if write_now:
+            _write_pending(path)  # entries were archived: persist the trim now
+        return record
+    _user_cache[path] = (signature, record)
+    return record
+
+
+def _store_user_cached(path, user_data, *, fsync=True):
+    """
+    Persist a record and remember it as the current cached version.
+    This also covers any deferred appends queued for the same file.
+    """
+    try:
+        _write_user_atomic(path, user_data, fsync=fsync)
+        _user_cache[path] = (_file_signature(path), user_data)
+    except Exception:
+        _discard_cached(path)
+        raise
+    with _pending_lock:
+        _pending_writes.pop(path, None)
+    _pending_mutators.pop(path, None)
+
+
+def _discard_cached(path):
+    """
+    Drop a cached record (call under the user's lock). A record still holding
+    deferred appends is written out first, and kept queued if that fails.
+    """
+    if path in _pending_writes and not _write_pending(path):
+        return
+    _user_cache.pop(path, None)
+
+
 def _list_user_entries():
     try:
         return [name for name in os.listdir(USERS_DIR) if name.endswith(".json")]
@@ -80,43 +240,207 @@ def _list_user_entries():
         return []
 
 
+def _refresh_name_index():
+    """Rebuild the case-insensitive name index if USERS_DIR changed on disk."""
+    global _name_index, _name_index_mtime
+    try:
+        mtime = os.stat(USERS_DIR).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _name_index_lock:
+        if mtime is not None and mtime == _name_index_mtime:
+            return
+        index = {}
+        for entry in _list_user_entries():
+            base = entry[:-5]
+            index.setdefault(base.lower(), base)
+        _name_index = index
+        _name_index_mtime = mtime
+
+
 def _resolve_username_path(username):
     """Find the file path and canonical username for the given username."""
-    target = (username or "").strip()
+    target = _normalize_username(username)
     if not target:
         return None, None
     candidate = os.path.join(USERS_DIR, f"{target}.json")
     if os.path.exists(candidate):
         return candidate, target
     lower = target.lower()
-    for entry in _list_user_entries():
-        base = entry[:-5]
-        if base.lower() == lower:
-            return os.path.join(USERS_DIR, entry), base
+    for refresh in (False, True):
+        if refresh:
+            _refresh_name_index()
+        base = _name_index.get(lower)
+        if base is not None:
+            path = os.path.join(USERS_DIR, f"{base}.json")
+            if os.path.exists(path):
+                return path, base
     return None, None
 
 
-def _update_user_record(username, mutator):
-    """Internal helper to mutate a specific user and persist the change."""
+def _lock_for(username):
+    """Return the lock guarding a single user's file (case-insensitive)."""
+    key = _normalize_username(username).lower()
+    return _user_locks[hash(key) % _USER_LOCK_STRIPES]
+
+
+def _update_user_record(username, mutator, *, fsync=True, deferred=False):
+    """
+    Internal helper to mutate a specific user and persist the change.
+    With deferred=True the mutated record stays in the cache and is written
+    by the background writer (see _schedule_write), unless the mutator
+    returns a true value to have it written right away.
+    """
     _ensure_storage_initialized()
-    with _users_lock:
+    with _lock_for(username):
         path, canonical = _resolve_username_path(username)
         if not path:
             return False, "User not found"
-        user = _load_user_file(path) or {}
+        user = _load_user_cached(path) or {}
         if not user.get("username"):
             user["username"] = canonical
         try:
-            mutator(user)
+            write_now = mutator(user)
         except Exception as exc:  # noqa: BLE001
+            _discard_cached(path)  # the cached dict may be half-mutated
             return False, f"Failed to update user data: {exc}"
+        if deferred:
+            cached = _user_cache.get(path)
+            if write_now or cached is None or cached[1] is not user:
+                # The mutator asked for an immediate write, or the dict we
+                # mutated is not the cached one (corrupt/empty file).
+                try:
+                    _store_user_cached(path, user, fsync=False)
+                except Exception:
+                    return False, "Server write failed"
+            else:
+                _schedule_write(path, canonical)
+                _pending_mutators.setdefault(path, []).append(mutator)
+            return True, "ok"
         try:
-            _write_user_atomic(path, user)
+            _store_user_cached(path, user, fsync=fsync)
         except Exception:
             return False, "Server write failed"
         return True, "ok"
 
 
+def _schedule_write(path, username):
+    """Queue a cached record for the background writer (starting it if needed)."""
+    global _writer_thread
+    with _pending_lock:
+        _pending_writes[path] = username
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(
+                target=_write_pending_loop, name="user-writer", daemon=True
+            )
+            _writer_thread.start()
+    _pending_event.set()
+
+
+def _write_pending_loop():
+    while True:
+        _pending_event.wait()
+        time.sleep(WRITE_BATCH_DELAY)  # let concurrent appends coalesce
+        if flush_pending_writes():
+            time.sleep(WRITE_RETRY_DELAY)
+            _pending_event.set()
+
+
+def _write_pending(path):
+    """
+    Write the cached record queued for `path` (call under the user's lock).
+    Returns False if the write failed; the record then stays cached and queued.
+    """
+    _load_user_cached(path)  # picks up outside edits, replaying queued updates
+    if path not in _pending_writes:
+        return True  # the reload already wrote it
+    cached = _user_cache.get(path)
+    if cached is not None:
+        try:
+            _write_user_atomic(path, cached[1], fsync=False)
+            _user_cache[path] = (_file_signature(path), cached[1])
+        except Exception:
+            logger.exception("Deferred write of %s failed; will retry", path)
+            return False
+    with _pending_lock:
+        _pending_writes.pop(path, None)
+    _pending_mutators.pop(path, None)
+    return True
+
+
+def flush_pending_writes():
+    """
+    Write every record queued by deferred updates; safe to call at any time.
+    Returns the number of writes that failed and remain queued.
+    """
+    with _pending_lock:
+        _pending_event.clear()
+        batch = list(_pending_writes.items())
+    failed = 0
+    for path, username in batch:
+        with _lock_for(username):
+            if path in _pending_writes and not _write_pending(path):
+                failed += 1
+    return failed
+
+
+atexit.register(flush_pending_writes)
+
+
+def _open_stability_db():
+    """Open (once) the archive database (call under _stability_db_lock)."""
+    global _stability_db
+    if _stability_db is None:
+        conn = sqlite3.connect(STABILITY_DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stability ("
+            " username TEXT NOT NULL COLLATE NOCASE,"
+            " kind TEXT NOT NULL,"
+            " record TEXT NOT NULL,"
+            " archived_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS stability_user_kind"
+            " ON stability (username, kind)"
+        )
+        _stability_db = conn
+    return _stability_db
+
+
+def _archive_history(username, key, entries):
+    """Move history entries into the SQLite archive in one transaction."""
+    now = time.time()
+    rows = [(username, key, orjson.dumps(entry).decode(), now) for entry in entries]
+    with _stability_db_lock:
+        conn = _open_stability_db()
+        with conn:
+            conn.executemany(
+                "INSERT INTO stability (username, kind, record, archived_at)"
+                " VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+
+def _append_history(user, key, record):
+    """
+    Append to user[key]; past MAX_HISTORY + ARCHIVE_BATCH entries, archive the
+    oldest down to MAX_HISTORY. Archiving happens before `user` is touched, so
+    a failure leaves it unchanged. Returns True when entries were archived:
+    the trimmed record must then be written at once, or a lost write would
+    archive the same entries again.
+    """
+    history = user.setdefault(key, [])
+    overflow = len(history) + 1 - MAX_HISTORY
+    archived = overflow > ARCHIVE_BATCH
+    if archived:
+        _archive_history(user["username"], key, history[:overflow])
+        del history[:overflow]
+    history.append(record)
+    return archived
+
+
 # ---------------------------
 # User operations
 # ---------------------------
@@ -128,7 +452,7 @@ def register_user(username, password, *, auto_generated=False):
     the desired complexity requirements.
     """
     _ensure_storage_initialized()
-    username = username.strip()
+    username = _normalize_username(username)
     password = (password or "").strip()
     if not username:
         return False, "Username is required"
@@ -139,22 +463,28 @@ def register_user(username, password, *, auto_generated=False):
     if not auto_generated and len(password) < 6:
         return False, "Password must be at least 6 characters long"
 
+    # PBKDF2 is the slow part of registration; keep it outside the lock.
+    pwd_hash = generate_password_hash(password)
+    user_payload = {
+        "username": username,
+        "password_hash": pwd_hash,
+        "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    target_path = os.path.join(USERS_DIR, f"{username}.json")
+
+    # The lock only covers the case-insensitive collision check and the
+    # exclusive create (which also guards against other processes).
     with _users_lock:
         path, _ = _resolve_username_path(username)
         if path:
             return False, "Username already exists"
-
-        pwd_hash = generate_password_hash(password)
-        user_payload = {
-            "username": username,
-            "password_hash": pwd_hash,
-            "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
-        }
-        target_path = os.path.join(USERS_DIR, f"{username}.json")
         try:
-            _write_user_atomic(target_path, user_payload)
+            _write_user_atomic(target_path, user_payload, exclusive=True)
+        except FileExistsError:
+            return False, "Username already exists"
         except Exception:
             return False, "Server write failed"
+        _name_index[username.lower()] = username
 
     return True, username
 
@@ -164,21 +494,24 @@ def authenticate_user(username, password):
     Validate login credentials and return (True, username) or (False, error_message).
     """
     _ensure_storage_initialized()
-    username = username.strip()
+    username = _normalize_username(username)
     if not username or not password:
         return False, "Username or password cannot be empty"
 
-    with _users_lock:
+    with _lock_for(username):
         path, canonical = _resolve_username_path(username)
         if not path:
             return False, "User not found"
-        user = _load_user_file(path)
+        user = _load_user_cached(path)
         if not user:
             return False, "User not found"
         pwd_hash = user.get("password_hash")
-        if not pwd_hash or not check_password_hash(pwd_hash, password):
-            return False, "Incorrect password"
-        return True, user.get("username", canonical)
+        canonical = user.get("username", canonical)
+
+    # Verify outside the lock so a slow PBKDF2 check does not block updates.
+    if not pwd_hash or not check_password_hash(pwd_hash, password):
+        return False, "Incorrect password"
+    return True, canonical
 
 
 def list_users():
@@ -194,19 +527,28 @@ def list_users():
 
 
 def get_user_record(username):
-    """Get the full user record (deep copy to avoid external mutation)."""
+    """
+    Get the full user record.
+    Returns a private copy of the cached record (an orjson round-trip, much
+    cheaper than copy.deepcopy) so callers cannot mutate shared state. Records
+    orjson cannot encode (ints wider than 64 bits, which only legacy files
+    parsed with json can hold) fall back to deepcopy.
+    """
     _ensure_storage_initialized()
-    username = (username or "").strip()
+    username = _normalize_username(username)
     if not username:
         return None
-    with _users_lock:
+    with _lock_for(username):
         path, _ = _resolve_username_path(username)
         if not path:
             return None
-        record = _load_user_file(path)
+        record = _load_user_cached(path)
         if not record:
             return None
-        return deepcopy(record)
+        try:
+            return orjson.loads(orjson.dumps(record))
+        except orjson.JSONEncodeError:
+            return copy.deepcopy(record)
     return None
 
 
@@ -214,10 +556,10 @@ def store_user_fingerprint(username, fingerprint_payload):
     """
     Save the user's static fingerprint information.
     """
-    username = (username or "").strip()
+    username = _normalize_username(username)
     if not username:
         return False, "Username is required"
-    if not isinstance(fingerprint_payload, dict):
+    if not isinstance(fingerprint_payload, dict) or not _is_storable(fingerprint_payload):
         return False, "Invalid fingerprint data format"
 
     return _update_user_record(
@@ -230,10 +572,10 @@ def store_system_timing(username, timing_record):
     """
     Save the total system timing (from fingerprint capture start to all tests complete).
     """
-    username = (username or "").strip()
+    username = _normalize_username(username)
     if not username:
         return False, "Username is required"
-    if not isinstance(timing_record, dict):
+    if not isinstance(timing_record, dict) or not _is_storable(timing_record):
         return False, "Invalid timing data format"
 
     return _update_user_record(
@@ -246,24 +588,23 @@ def append_triangle_stability(username, stability_record):
     """
     Record WebGL triangle stability results.
     """
-    username = (username or "").strip()
+    username = _normalize_username(username)
     if not username:
         return False, "Username is required"
-    if not isinstance(stability_record, dict):
+    if not isinstance(stability_record, dict) or not _is_storable(stability_record):
         return False, "Invalid result data format"
 
     def mutator(user):
-        history = user.setdefault("triangle_stability", [])
-        history.append(stability_record)
+        return _append_history(user, "triangle_stability", stability_record)
 
-    return _update_user_record(username, mutator)
+    return _update_user_record(username, mutator, deferred=True)
 
 
 def set_triangle_baseline(username, baseline_hash, *, overwrite=False):
     """
     Set or update the user's triangle baseline hash.
     """
-    username = (username or "").strip()
+    username = _normalize_username(username)
     baseline_hash = (baseline_hash or "").strip()
     if not username:
         return False, "Username is required"
@@ -279,22 +620,21 @@ def set_triangle_baseline(username, baseline_hash, *, overwrite=False):
 
 def append_triangle2_stability(username, stability_record):
     """Record WebGL (routes2) triangle stability results."""
-    username = (username or "").strip()
+    username = _normalize_username(username)
     if not username:
         return False, "Username is required"
-    if not isinstance(stability_record, dict):
+    if not isinstance(stability_record, dict) or not _is_storable(stability_record):
         return False, "Invalid result data format"
 
     def mutator(user):
-        history = user.setdefault("triangle2_stability", [])
-        history.append(stability_record)
+        return _append_history(user, "triangle2_stability", stability_record)
 
-    return _update_user_record(username, mutator)
+    return _update_user_record(username, mutator, deferred=True)
 
 
 def set_triangle2_baseline(username, baseline_hash, *, overwrite=False):
     """Set or update the routes2 WebGL triangle baseline hash."""
-    username = (username or "").strip()
+    username = _normalize_username(username)
     baseline_hash = (baseline_hash or "").strip()
     if not username:
         return False, "Username is required"
@@ -310,22 +650,21 @@ def set_triangle2_baseline(username, baseline_hash, *, overwrite=False):
 
 def append_audio_stability(username, stability_record):
     """Record audio automated test stability results."""
-    username = (username or "").strip()
+    username = _normalize_username(username)
     if not username:
         return False, "Username is required"
-    if not isinstance(stability_record, dict):
+    if not isinstance(stability_record, dict) or not _is_storable(stability_record):
         return False, "Invalid result data format"
 
     def mutator(user):
-        history = user.setdefault("audio_stability", [])
-        history.append(stability_record)
+        return _append_history(user, "audio_stability", stability_record)
 
-    return _update_user_record(username, mutator)
+    return _update_user_record(username, mutator, deferred=True)
 
 
 def set_audio_baseline(username, baseline_hash, *, overwrite=False):
     """Set or update the user's audio baseline hash."""
-    username = (username or "").strip()
+    username = _normalize_username(username)
     baseline_hash = (baseline_hash or "").strip()
     if not username:
         return False, "Username is required"
@@ -341,22 +680,21 @@ def set_audio_baseline(username, baseline_hash, *, overwrite=False):
 
 def append_canvas_stability(username, stability_record):
     """Record Canvas automated test stability results."""
-    username = (username or "").strip()
+    username = _normalize_username(username)
     if not username:
         return False, "Username is required"
-    if not isinstance(stability_record, dict):
+    if not isinstance(stability_record, dict) or not _is_storable(stability_record):
         return False, "Invalid result data format"
 
     def mutator(user):
-        history = user.setdefault("canvas_stability", [])
-        history.append(stability_record)
+        return _append_history(user, "canvas_stability", stability_record)
 
-    return _update_user_record(username, mutator)
+    return _update_user_record(username, mutator, deferred=True)
 
 
 def set_canvas_baseline(username, seed, baseline_hash, *, overwrite=False):
     """Set or update the user's Canvas baseline hash (segmented by seed)."""
-    username = (username or "").strip()
+    username = _normalize_username(username)
     seed = (seed or "__default__").strip() or "__default__"
     baseline_hash = (baseline_hash or "").strip()
     if not username:
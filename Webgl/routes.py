@@ -1,310 +1,42 @@
-import base64
-import hmac
+import binascii
+import copy
 import hashlib
 import io
 import flask
-from typing import Optional, List, Tuple
+from typing import List, Tuple
 from flask import jsonify, request, Blueprint, render_template, json
-import os, struct
-from datetime import datetime
+import os
+import time
+from functools import lru_cache
 import math
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import numpy as np
 from scipy import ndimage
 
+from drbg import HMACDRBG
+from responses import json_response
 
-class HMACDRBG:
-    """
-    NIST SP 800-90A HMAC-DRBG (SHA-256) with (K, V) state.
-    - Instantiate(entropy_input, nonce, personalization_string)
-    - Reseed(entropy_input, additional_input)
-    - Generate(n_bytes, additional_input)
-    Also exposes randint(a, b) with rejection sampling (uniform, no modulo bias).
-    """
-
-    def __init__(
-        self,
-        entropy_input: bytes,
-        nonce: bytes = b"",
-        personalization_string: bytes = b"",
-        reseed_interval: int = 2**48,  # per spec (practically "very large")
-    ):
-        self._hash = hashlib.sha256
-        self._outlen = self._hash().digest_size  # 32 bytes for SHA-256
-        # 10.1.2.3 Instantiate Process
-        self.K = b"\x00" * self._outlen
-        self.V = b"\x01" * self._outlen
-        seed_material = entropy_input + nonce + personalization_string
-        self._update(seed_material)
-        self.reseed_counter = 1
-        self.reseed_interval = reseed_interval
-
-    # --- Internal helpers (spec 10.1.2.2 Update Function) ---
-    def _hmac(self, key: bytes, data: bytes) -> bytes:
-        return hmac.new(key, data, self._hash).digest()
-
-    def _update(self, provided_data: Optional[bytes]):
-        # K = HMAC(K, V || 0x00 || provided_data)
-        # V = HMAC(K, V)
-        if provided_data is None:
-            provided_data = b""
-        self.K = self._hmac(self.K, self.V + b"\x00" + provided_data)
-        self.V = self._hmac(self.K, self.V)
-
-        if len(provided_data) > 0:
-            # K = HMAC(K, V || 0x01 || provided_data)
-            # V = HMAC(K, V)
-            self.K = self._hmac(self.K, self.V + b"\x01" + provided_data)
-            self.V = self._hmac(self.K, self.V)
-
-    # --- Public API ---
-
-    def reseed(self, entropy_input: bytes, additional_input: bytes = b""):
-        """
-        10.1.2.4 Reseed Process
-        """
-        seed_material = entropy_input + additional_input
-        self._update(seed_material)
-        self.reseed_counter = 1
-
-    def generate(self, n_bytes: int, additional_input: bytes = b"") -> bytes:
-        """
-        10.1.2.5 Generate Process
-        - Optionally mixes additional_input before generating
-        - Optionally performs an additional update after generation if additional_input is non-empty
-        """
-        if self.reseed_counter > self.reseed_interval:
-            raise RuntimeError(
-                "Reseed required (reseed_counter exceeded reseed_interval)."
-            )
-
-        if additional_input:
-            # K = HMAC(K, V || 0x00 || additional_input); V = HMAC(K, V)
-            self.K = self._hmac(self.K, self.V + b"\x00" + additional_input)
-            self.V = self._hmac(self.K, self.V)
-
-        # Produce pseudorandom bytes
-        temp = bytearray()
-        while len(temp) < n_bytes:
-            self.V = self._hmac(self.K, self.V)
-            temp += self.V
-
-        returned_bits = bytes(temp[:n_bytes])
-
-        if additional_input:
-            # Post-generation update (if additional_input provided)
-            self.K = self._hmac(self.K, self.V + b"\x00" + additional_input)
-            self.V = self._hmac(self.K, self.V)
-
-        self.reseed_counter += 1
-        return returned_bits
-
-    # --- Convenience on top of Generate() ---
-
-    def randint(self, a: int, b: int) -> int:
-        """
-        Returns a uniform integer in [a, b] using rejection sampling (no modulo bias).
-        """
-        if a > b:
-            raise ValueError("a must be <= b")
-        span = b - a + 1
-        if span <= 0:
-            # Shouldn't happen for finite ints, but just in case
-            raise ValueError("Invalid span")
-
-        # Determine how many bytes we need to cover the span
-        # We draw k bytes => 0..(2^(8k)-1). Accept if within limit, else retry.
-        # limit = floor((2^(8k) / span)) * span - 1
-        # Choose smallest k such that 2^(8k) >= span
-        k = 1
-        while (1 << (8 * k)) < span:
-            k += 1
-
-        space = 1 << (8 * k)
-        limit = (space // span) * span - 1
-
-        while True:
-            r = int.from_bytes(self.generate(k), "big")
-            if r <= limit:
-                return a + (r % span)
-
-    def random_float(self) -> float:
-        """
-        Return a uniform float in [0.0, 1.0) with 53 bits of precision.
-        """
-        # 7 bytes = 56 bits; we only need 53
-        raw = int.from_bytes(self.generate(7), "big")
-        x = raw >> 3  # discard 3 high bits
-        return x / (1 << 53)
-
-    def uniform(self, a: float, b: float) -> float:
-        """
-        Return a uniform float in [a, b).
-        """
-        return a + (b - a) * self.random_float()
-
-    def random_bytes(self, n: int) -> bytes:
-        return self.generate(n)
-
-
-class AABB:
-    __slots__ = ("x0", "y0", "x1", "y1")
-
-    def __init__(self, x0, y0, x1, y1):
-        if x1 < x0 or y1 < y0:
-            raise ValueError("Invalid AABB: (x1,y1) must be >= (x0,y0)")
-        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
-
-    def intersects(self, other):
-        # Half-open boxes: edges touching do NOT count as intersection.
-        return not (
-            self.x1 <= other.x0
-            or self.x0 >= other.x1
-            or self.y1 <= other.y0
-            or self.y0 >= other.y1
-        )
-
-    def contains_aabb(self, other):
-        # Full containment (half-open convention).
-        return (
-            self.x0 <= other.x0
-            and self.y0 <= other.y0
-            and self.x1 >= other.x1
-            and self.y1 >= other.y1
-        )
-
-    def contains_point(self, x, y):
-        return (self.x0 <= x < self.x1) and (self.y0 <= y < self.y1)
-
-
-class Quadtree:
-    __slots__ = (
-        "boundary",
-        "capacity",
-        "depth",
-        "max_depth",
-        "items",
-        "divided",
-        "nw",
-        "ne",
-        "sw",
-        "se",
-    )
-
-    def __init__(self, boundary, capacity=4, depth=0, max_depth=10):
-        self.boundary = boundary  # AABB
-        self.capacity = capacity
-        self.depth = depth
-        self.max_depth = max_depth
-
-        self.items = []  # list of (AABB, data)
-        self.divided = False
-        self.nw = self.ne = self.sw = self.se = None
-
-    def subdivide(self):
-        x0, y0, x1, y1 = (
-            self.boundary.x0,
-            self.boundary.y0,
-            self.boundary.x1,
-            self.boundary.y1,
-        )
-        mx = (x0 + x1) / 2.0
-        my = (y0 + y1) / 2.0
 
-        self.nw = Quadtree(
-            AABB(x0, y0, mx, my), self.capacity, self.depth + 1, self.max_depth
-        )
-        self.ne = Quadtree(
-            AABB(mx, y0, x1, my), self.capacity, self.depth + 1, self.max_depth
-        )
-        self.sw = Quadtree(
-            AABB(x0, my, mx, y1), self.capacity, self.depth + 1, self.max_depth
-        )
-        self.se = Quadtree(
-            AABB(mx, my, x1, y1), self.capacity, self.depth + 1, self.max_depth
-        )
-        self.divided = True
-
-    def _child_for(self, aabb):
-        """Return a child node that fully contains `aabb`, or None if it spans multiple."""
-        if not self.divided:
-            return None
-        for child in (self.nw, self.ne, self.sw, self.se):
-            if child.boundary.contains_aabb(aabb):
-                return child
-        return None
-
-    def _maybe_split_and_push_down(self):
-        """Subdivide if needed and push down items that now fit in a child."""
-        if (
-            self.divided
-            or (len(self.items) <= self.capacity)
-            or (self.depth >= self.max_depth)
-        ):
-            return
-        self.subdivide()
-        kept = []
-        for aabb, data in self.items:
-            child = self._child_for(aabb)
-            if child is not None:
-                child.insert(aabb, data)
-            else:
-                kept.append((aabb, data))
-        self.items = kept
-
-    def insert(self, aabb, data):
-        # Option A: reject if not even overlapping the global boundary (fast path).
-        if not self.boundary.intersects(aabb) and not self.boundary.contains_aabb(aabb):
-            return False
-
-        # If we can place deeper, try to do so.
-        if self.divided:
-            child = self._child_for(aabb)
-            if child is not None:
-                return child.insert(aabb, data)
-
-        # Store here.
-        self.items.append((aabb, data))
-
-        # If over capacity, split and push down.
-        self._maybe_split_and_push_down()
-        return True
-
-    def query(self, range_aabb, found=None):
-        if found is None:
-            found = []
-
-        if not self.boundary.intersects(range_aabb):
-            return found
-
-        # Collect from this node
-        for aabb, data in self.items:
-            if aabb.intersects(range_aabb):
-                found.append((aabb, data))
-
-        # Search children
-        if self.divided:
-            self.nw.query(range_aabb, found)
-            self.ne.query(range_aabb, found)
-            self.sw.query(range_aabb, found)
-            self.se.query(range_aabb, found)
-
-        return found
-
-    def query_point(self, x, y, found=None):
-        if found is None:
-            found = []
-        if not self.boundary.contains_point(x, y):
-            return found
-
-        for aabb, data in self.items:
-            if aabb.contains_point(x, y):
-                found.append((aabb, data))
-
-        if self.divided:
-            for child in (self.nw, self.ne, self.sw, self.se):
-                child.query_point(x, y, found)
-        return found
+# Static triangle (x0, y0, x1, y1, x2, y2) relative to its random integer offset.
+# float64 so the vertices reach the client exactly as before.
+_TRIANGLE_TEMPLATE = np.array(
+    [
+        0,
+        55,
+        17.38389009393539,
+        0.67781283689527,
+        39.3956816724991,
+        8.0780276923631,
+    ],
+    dtype=np.float64,
+)
+# The offsets and margin are integers, so floor/ceil of the translated extents
+# is the offset plus floor/ceil of the template's own extents.
+_TEMPLATE_MIN_X = math.floor(min(_TRIANGLE_TEMPLATE[0::2]))
+_TEMPLATE_MIN_Y = math.floor(min(_TRIANGLE_TEMPLATE[1::2]))
+_TEMPLATE_MAX_X = math.ceil(max(_TRIANGLE_TEMPLATE[0::2]))
+_TEMPLATE_MAX_Y = math.ceil(max(_TRIANGLE_TEMPLATE[1::2]))
 
 
 def generate_triangle_in_region(
@@ -321,26 +53,15 @@ def generate_triangle_in_region(
     @param margin: The margin inside the region.
     @param box_width: The max width of the box that contains the triangle.
     @param box_height: The max height of the box that contains the triangle.
-    @return: A list of 3 points representing the triangle.
+    @return: A float64 array of 3 points (x0, y0, x1, y1, x2, y2) representing
+        the triangle, and its integer bbox.
     """
     # static triangle
-    triangle = [
-        0,
-        55,
-        17.38389009393539,
-        0.67781283689527,
-        39.3956816724991,
-        8.0780276923631,
-    ]
-
     x_offset = drbg_pos.randint(x0 + margin, x1 - margin - box_width)
     y_offset = drbg_pos.randint(y0 + margin + box_height, y1 - margin - box_height)
-    triangle[0] += x_offset
-    triangle[1] += y_offset
-    triangle[2] += x_offset
-    triangle[3] += y_offset
-    triangle[4] += x_offset
-    triangle[5] += y_offset
+    triangle = _TRIANGLE_TEMPLATE.copy()
+    triangle[0::2] += x_offset
+    triangle[1::2] += y_offset
 
     # # Generates a random position for the left most vertex.
     # triangle = [
@@ -355,32 +76,80 @@ def generate_triangle_in_region(
     # triangle[5] += drbg_shape.uniform(-box_height, box_height)
 
     bbox = [
-        math.floor(min(triangle[0], triangle[2], triangle[4]) - margin),
-        math.floor(min(triangle[1], triangle[3], triangle[5]) - margin),
-        math.ceil(max(triangle[0], triangle[2], triangle[4]) + margin),
-        math.ceil(max(triangle[1], triangle[3], triangle[5]) + margin),
+        x_offset + _TEMPLATE_MIN_X - margin,
+        y_offset + _TEMPLATE_MIN_Y - margin,
+        x_offset + _TEMPLATE_MAX_X + margin,
+        y_offset + _TEMPLATE_MAX_Y + margin,
     ]
     return triangle, bbox
 
 
+def _overlaps(prior, x0, y0, x1, y1):
+    """Return True if the box (x0, y0, x1, y1) overlaps any column of `prior`."""
+    px0, py0, px1, py1 = prior
+    return bool(np.any((px0 < x1) & (px1 > x0) & (py0 < y1) & (py1 > y0)))
+
+
+# Candidates per re-placement batch: start small for sparse canvases and double
+# (up to the cap) while a crowded canvas keeps rejecting them.
+_PLACE_BATCH_MIN = 4
+_PLACE_BATCH_MAX = 64
+
+
+def _retry_rng(drbg_pos) -> np.random.Generator:
+    """
+    Philox counter-mode generator whose 128-bit key (2 x uint64) is 16 bytes
+    drawn from `drbg_pos`. Re-placement candidates only need to be
+    reproducible from the DRBG, not individually HMAC-derived, so bulk draws
+    come from this stream instead.
+    """
+    key = np.frombuffer(drbg_pos.generate(16), dtype="<u8")
+    return np.random.Generator(np.random.Philox(key=key))
+
+
+def _try_place(rng, prior, box_w, box_h, width, height, count):
+    """
+    Draw `count` random top-left corners for a box_w x box_h bbox inside the
+    canvas and test them all against `prior` in one broadcast comparison.
+    @return: ((x0, y0), tries) for the first free candidate, where `tries` is how
+        many candidates were consumed, or (None, count) if every one overlapped.
+    """
+    xs = rng.integers(0, width - box_w, size=(count, 1), endpoint=True)
+    ys = rng.integers(0, height - box_h, size=(count, 1), endpoint=True)
+    px0, py0, px1, py1 = prior
+    hits = (
+        (px0 < xs + box_w) & (px1 > xs) & (py0 < ys + box_h) & (py1 > ys)
+    ).any(axis=1)
+    free = np.flatnonzero(~hits)
+    if not free.size:
+        return None, count
+    i = int(free[0])
+    return (int(xs[i, 0]), int(ys[i, 0])), i + 1
+
+
 def generate_non_overlapping_triangles_quadtree(
     drbg_pos, drbg_shape, n, width, height, triangle_size=64
 ):
     """
-    Generate n non-overlapping triangles.
+    Generate n non-overlapping triangles, returned as an (n, 6) float64 array
+    alongside the list of their integer bboxes.
+    Accepted bboxes are kept column-wise in one (4, n) array (x0, y0, x1, y1
+    rows; uint16 whenever the canvas fits) so each overlap check is a single
+    vectorised comparison over contiguous coordinates.
     """
-    triangles = []
+    triangles = np.empty((n, 6), dtype=np.float64)
     bboxes = []
-    quadtree = Quadtree(AABB(0, 0, width, height))
+    coord_dtype = np.uint16 if max(width, height) <= 0xFFFF else np.int32
+    placed = np.empty((4, n), dtype=coord_dtype)
     max_attempts = n * 10  # Maximum attempts to avoid infinite loops
     attempts = 0
+    retry_rng = None  # keyed from drbg_pos on the first overlap
 
     if triangle_size > width or triangle_size * 2 > height:
         raise ValueError("Triangle size is too large for the canvas")
 
-    current_triangle = None
-    while len(triangles) < n and attempts < max_attempts:
-        current_triangle, bbox = generate_triangle_in_region(
+    while len(bboxes) < n and attempts < max_attempts:
+        triangle, bbox = generate_triangle_in_region(
             drbg_pos,
             drbg_shape,
             0,
@@ -391,54 +160,116 @@ def generate_non_overlapping_triangles_quadtree(
             box_width=triangle_size,
             box_height=triangle_size,
         )
-        x_offset = 0
-        y_offset = 0
-
-        overlap = False
-        while attempts < max_attempts:
-            bbox[0] += x_offset
-            bbox[1] += y_offset
-            bbox[2] += x_offset
-            bbox[3] += y_offset
-
-            current_triangle[0] += x_offset
-            current_triangle[1] += y_offset
-            current_triangle[2] += x_offset
-            current_triangle[3] += y_offset
-            current_triangle[4] += x_offset
-            current_triangle[5] += y_offset
-
-            overlapping_items = quadtree.query(AABB(bbox[0], bbox[1], bbox[2], bbox[3]))
-            overlap = len(overlapping_items) > 0
-
-            if overlap:
-                x_offset = drbg_pos.randint(-bbox[0], width - bbox[2])
-                y_offset = drbg_pos.randint(-bbox[1], height - bbox[3])
-                attempts += 1
-            else:
-                break
-
-        if not overlap:
-            triangles.append(current_triangle)
-            bboxes.append(bbox)
-            quadtree.insert(AABB(bbox[0], bbox[1], bbox[2], bbox[3]), current_triangle)
-
-    if len(triangles) < n:
+        prior = placed[:, : len(bboxes)]
+        box_w = bbox[2] - bbox[0]
+        box_h = bbox[3] - bbox[1]
+
+        # Keep the drawn position if it is free, otherwise re-place the same
+        # box uniformly over the canvas, a batch of candidates at a time,
+        # until one fits or attempts run out.
+        position = None if _overlaps(prior, *bbox) else (bbox[0], bbox[1])
+        batch = _PLACE_BATCH_MIN
+        while position is None and attempts < max_attempts:
+            if retry_rng is None:
+                retry_rng = _retry_rng(drbg_pos)
+            count = min(batch, max_attempts - attempts)
+            position, tries = _try_place(
+                retry_rng, prior, box_w, box_h, width, height, count
+            )
+            attempts += tries
+            batch = min(batch * 2, _PLACE_BATCH_MAX)
+        if position is None:
+            break
+
+        # Translate the triangle once, on acceptance.
+        row = triangles[len(bboxes)]
+        row[:] = triangle
+        row[0::2] += position[0] - bbox[0]
+        row[1::2] += position[1] - bbox[1]
+        bbox = [position[0], position[1], position[0] + box_w, position[1] + box_h]
+
+        placed[:, len(bboxes)] = bbox
+        bboxes.append(bbox)
+
+    if len(bboxes) < n:
         raise ValueError("Failed to generate non-overlapping triangles")
 
     return triangles, bboxes
 
 
-def tighten_image(img: Image.Image) -> Image.Image:
-    """Trim transparent borders from an RGBA image."""
-    rgba_img = img.convert("RGBA")
-    alpha_channel = rgba_img.split()[3]
-    bbox = alpha_channel.getbbox()
-    return rgba_img.crop(bbox) if bbox else rgba_img
+def _hash_segment(pixels: np.ndarray, bbox, pad: np.ndarray) -> bytes:
+    """
+    Hash the tightened RGBA pixels of one triangle bbox.
+    Works on slices of the shared `pixels` array; returns the same raw digest
+    as cropping the decoded upload to `bbox`, converting to RGBA, trimming
+    fully transparent borders and hashing the bytes; `pad` is the RGBA form
+    of the padding PIL's crop adds in the upload's mode.
+    """
+    x0, y0, x1, y1 = bbox
+    height, width = pixels.shape[:2]
+    sub = pixels[max(0, y0) : max(0, y1), max(0, x0) : max(0, x1)]
+    if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+        # The crop is padded before the RGBA conversion, so e.g. RGB uploads
+        # get opaque padding that survives tightening and is hashed.
+        padded = np.empty((y1 - y0, x1 - x0, 4), dtype=np.uint8)
+        padded[...] = pad
+        top, left = max(0, -y0), max(0, -x0)
+        padded[top : top + sub.shape[0], left : left + sub.shape[1]] = sub
+        sub = padded
+    alpha = sub[..., 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if rows.size:
+        cols = np.flatnonzero(alpha.any(axis=0))
+        sub = sub[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1]
+    # hashlib reads the buffer directly; only a strided slice needs packing.
+    return hashlib.sha256(np.ascontiguousarray(sub)).digest()
 
 
 entropy = b"o\xd6\xb6m\xd0{\xbfRy\xbc[\xa2\x1f\xb8\x0c\x92\xb4z+\x9b\xf7c\xdf\xf2\xd9\x1fhP\xf6h4\xdb"  # os.urandom(32)
 db = {}
+
+# Upload limits, checked before any decoding work: the raw request body, and
+# the pixel count read from the PNG header.
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+MAX_UPLOAD_PIXELS = 4096 * 4096
+
+# Segments are hashed concurrently; NumPy reductions and hashlib release the GIL.
+_HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="webgl-hash")
+
+
+_month_nonce_cache: Tuple[Tuple[int, int], bytes] = ((0, 0), b"")
+
+
+def _month_nonce() -> bytes:
+    """Local "YYYY-MM" nonce, rebuilt only when the month rolls over."""
+    global _month_nonce_cache
+    now = time.localtime()
+    month, nonce = _month_nonce_cache
+    if month != (now.tm_year, now.tm_mon):
+        nonce = b"%04d-%02d" % (now.tm_year, now.tm_mon)
+        _month_nonce_cache = ((now.tm_year, now.tm_mon), nonce)
+    return nonce
+
+
+def _request_nonce() -> bytes:
+    """Per-request nonce from the wall clock in nanoseconds."""
+    return time.time_ns().to_bytes(8, "big")
+
+
+@lru_cache(maxsize=1024)
+def _shape_drbg_template(nonce: bytes, seed: bytes) -> HMACDRBG:
+    return HMACDRBG(entropy_input=entropy, nonce=nonce, personalization_string=seed)
+
+
+def _shape_drbg(seed: bytes) -> HMACDRBG:
+    """
+    Return a fresh month-keyed shape DRBG for `seed`.
+    Its instantiation only depends on (month, seed), so it is cloned from a
+    cached template rather than re-running the Instantiate HMACs per request.
+    """
+    return copy.copy(_shape_drbg_template(_month_nonce(), seed))
+
+
 # app = flask.Flask(__name__)
 webgl_bp = Blueprint(
     "webgl", __name__, template_folder="templates", static_folder="static"
@@ -463,48 +294,38 @@ def serve_fingerprint():
 @webgl_bp.route("/get_triangle/<string:seed>/<int:width>/<int:height>")
 def get_triangle(seed, width, height):
     seed = seed.encode("utf-8")
-    timestamp = str(datetime.now().timestamp())
     drbg_pos = HMACDRBG(
         entropy_input=entropy,
-        nonce=struct.pack("d", float(timestamp)),
+        nonce=_request_nonce(),
         personalization_string=seed,
     )
 
-    drbg_shape = HMACDRBG(
-        entropy_input=entropy,
-        nonce=datetime.now().strftime("%Y-%m").encode("utf-8"),
-        personalization_string=seed,
-    )
+    drbg_shape = _shape_drbg(seed)
 
     triangle, _ = generate_triangle_in_region(
         drbg_pos, drbg_shape, 0, 0, width, height, 3, 64, 64
     )
 
-    return jsonify({"triangle": triangle})
+    return json_response({"triangle": triangle})
 
 
 @webgl_bp.route("/get_triangles/<int:n>/<string:seed>/<int:width>/<int:height>")
 def get_triangles(n, seed, width, height):
     seed = seed.encode("utf-8")
-    timestamp = str(datetime.now().timestamp())
     drbg_pos = HMACDRBG(
         entropy_input=entropy,
-        nonce=struct.pack("d", float(timestamp)),
-        personalization_string=seed,
-    )
-    drbg_shape = HMACDRBG(
-        entropy_input=entropy,
-        nonce=datetime.now().strftime("%Y-%m").encode("utf-8"),
+        nonce=_request_nonce(),
         personalization_string=seed,
     )
+    drbg_shape = _shape_drbg(seed)
 
-    # Generate non-overlapping triangles using quadtree overlapping testing
+    # Generate non-overlapping triangles (bbox overlap tested against all placed)
     try:
         triangles, bboxes = generate_non_overlapping_triangles_quadtree(
             drbg_pos, drbg_shape, n, width, height
         )
         db[seed] = bboxes
-        return jsonify({"triangle": triangles})
+        return json_response({"triangle": triangles})
     except Exception as e:
         return jsonify({"error": f"Error generating triangles: {str(e)}"}), 500
 
@@ -526,37 +347,53 @@ def upload_img(seed):
     seed = seed.encode("utf-8")
     if seed not in db:
         return jsonify({"error": "Seed not found"}), 404
+    if (request.content_length or 0) > MAX_UPLOAD_BYTES:
+        return jsonify({"error": "Image data too large"}), 413
     data_url = request.get_data()
     if not data_url:
         return jsonify({"error": "No image data provided"}), 400
+    if len(data_url) > MAX_UPLOAD_BYTES:
+        return jsonify({"error": "Image data too large"}), 413
 
-    try:
-        if data_url.startswith(b"data:image"):
-            # Find the comma and get the base64 part
-            comma_index = data_url.find(b",")
-            if comma_index != -1:
-                encoded = data_url[comma_index + 1 :]
-    except ValueError:
+    # Find the comma and view the base64 part in place instead of copying it out.
+    comma_index = data_url.find(b",")
+    if not data_url.startswith(b"data:image") or comma_index == -1:
         return jsonify({"error": "Invalid data URL"}), 400
+    encoded = memoryview(data_url)[comma_index + 1 :]
 
     try:
-        raw_bytes = base64.b64decode(encoded)
-        img = Image.open(io.BytesIO(raw_bytes))
+        raw_bytes = binascii.a2b_base64(encoded)
+        # The client sends canvas.toDataURL("image/png"): go straight to the PNG
+        # decoder and decode exactly once, inside this try, so corrupt data is
+        # reported as a 400 instead of failing later in the hashing workers.
+        with Image.open(io.BytesIO(raw_bytes), formats=("PNG",)) as img:
+            if img.width * img.height > MAX_UPLOAD_PIXELS:
+                return jsonify({"error": "Image dimensions too large"}), 413
+            img.load()
+        del raw_bytes, encoded
+        rgba_img = img if img.mode == "RGBA" else img.convert("RGBA")
+        # What crop() pads with outside the image, once converted to RGBA.
+        pad = np.asarray(img.crop((-1, -1, 0, 0)).convert("RGBA"))[0, 0]
     except Exception as exc:  # noqa: BLE001
         return jsonify({"error": f"Invalid image data: {exc}"}), 400
 
-    segment_hashes = []
-    for bbox in db[seed]:
-        cropped_img = img.crop(bbox)
-        tightened_img = tighten_image(cropped_img)
-        segment_hashes.append(hashlib.sha256(tightened_img.tobytes()).hexdigest())
+    pixels = np.asarray(rgba_img)  # one read-only copy shared by all workers
+    segment_digests = list(
+        _HASH_POOL.map(lambda bbox: _hash_segment(pixels, bbox, pad), db[seed])
+    )
 
-    combined_hash = hashlib.sha256("".join(sorted(segment_hashes)).encode()).hexdigest()
-    return jsonify(
+    # Raw digests sort in the same order as their hex forms, so feeding the
+    # sorted hex digests one by one reproduces sha256("".join(sorted(hexes)))
+    # without building the joined string.
+    combined = hashlib.sha256()
+    for digest in sorted(segment_digests):
+        combined.update(binascii.hexlify(digest))
+    combined_hash = combined.hexdigest()
+    return json_response(
         {
             "message": "Image uploaded successfully",
             "hash": combined_hash,
-            "individual_hashes": segment_hashes,
+            "individual_hashes": [digest.hex() for digest in segment_digests],
         }
     )
 
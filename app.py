@@ -1,4 +1,4 @@
-import csv
+import hmac
 import os
 import secrets
 import string
@@ -11,6 +11,7 @@ from flask import Flask, render_template, jsonify, request
 from Webgl.routes import webgl_bp
 from Audio.routes import audio_bp
 from Canvas.routes import canvas_bp
+from responses import json_response
 from User_Manager.user_manager import (
     register_user,
     authenticate_user,
@@ -29,8 +30,6 @@ auth_status = True
 total_auth = True
 global_hashes = []
 device_info = {}
-request_count = 0      # ✅ counter: track /analyze calls
-SAVE_INTERVAL = 10     # ✅ persist CSV every 10 requests
 app = Flask(__name__)
 # Register blueprints
 app.register_blueprint(webgl_bp, url_prefix='/webgl')
@@ -40,19 +39,37 @@ app.register_blueprint(canvas_bp, url_prefix='/canvas')
 SESSION_TIMEOUT_SECONDS = 300
 _session_state = {
     "owner": None,
+    "owner_key": None,  # owner.lower(), fixed when the session is acquired
     "token": None,
     "acquired_at": None,
+    "started_at": None,  # acquired_at as ISO text, formatted once for busy replies
     "last_heartbeat": None,
 }
 _session_lock = threading.Lock()
+# Immutable (owner_key, last_heartbeat) snapshot of _session_state, or None
+# when idle. Rebound under _session_lock whenever those fields change, so the
+# per-request owner check can read it without taking the lock.
+_session_view = None
+
+
+def _publish_session_locked():
+    """Refresh _session_view from _session_state (call under _session_lock)."""
+    global _session_view
+    owner_key = _session_state["owner_key"]
+    _session_view = (
+        (owner_key, _session_state["last_heartbeat"]) if owner_key else None
+    )
 
 
 def _clear_session_locked():
     """Reset the exclusive session state (call under _session_lock)."""
     _session_state["owner"] = None
+    _session_state["owner_key"] = None
     _session_state["token"] = None
     _session_state["acquired_at"] = None
+    _session_state["started_at"] = None
     _session_state["last_heartbeat"] = None
+    _publish_session_locked()
 
 
 def _is_session_stale(now_ts):
@@ -70,34 +87,129 @@ def _expire_session_if_needed(now_ts=None):
         _clear_session_locked()
 
 
+def _session_token_matches(token: str) -> bool:
+    """
+    Constant-time check of `token` against the active session token
+    (call under _session_lock). Compared as UTF-8 bytes because
+    compare_digest rejects non-ASCII str input.
+    """
+    expected = _session_state["token"] or ""
+    return hmac.compare_digest(expected.encode("utf-8"), token.encode("utf-8"))
+
+
 def _validate_session_owner(username: str):
     """Ensure the requesting user matches the active exclusive session."""
     username = (username or "").strip()
-    with _session_lock:
-        _expire_session_if_needed()
-        owner = _session_state["owner"]
-        if not owner:
-            return False, "The testing system is currently idle."
-        if owner.lower() != username.lower():
-            return (
-                False,
-                "Another user is currently running tests. Please try again later.",
-            )
+    view = _session_view
+    if view is not None and (time.time() - view[1]) > SESSION_TIMEOUT_SECONDS:
+        # Looks stale: expire it under the lock, then re-read the snapshot.
+        with _session_lock:
+            _expire_session_if_needed()
+            view = _session_view
+    if view is None:
+        return False, "The testing system is currently idle."
+    if view[0] != username.lower():
+        return (
+            False,
+            "Another user is currently running tests. Please try again later.",
+        )
     return True, None
 
 
+_PASSWORD_SPECIALS = "!@#$%^&*()-_=+[]{}"
+_PASSWORD_ALPHABET = (
+    string.ascii_lowercase + string.ascii_uppercase + string.digits + _PASSWORD_SPECIALS
+)
+# Every password must contain at least one character from each class.
+_PASSWORD_CLASSES = tuple(
+    frozenset(chars)
+    for chars in (
+        string.ascii_lowercase,
+        string.ascii_uppercase,
+        string.digits,
+        _PASSWORD_SPECIALS,
+    )
+)
+# byte -> alphabet character; bytes >= the largest multiple of the alphabet
+# size are rejected so every character stays equally likely.
+_PASSWORD_TABLE = bytes(
+    ord(_PASSWORD_ALPHABET[value % len(_PASSWORD_ALPHABET)]) for value in range(256)
+)
+_PASSWORD_REJECT = bytes(range(256 - 256 % len(_PASSWORD_ALPHABET), 256))
+
+
+# (whole second, formatted text) of the last _local_timestamp() result.
+_timestamp_cache = (None, "")
+
+
+def _local_timestamp() -> str:
+    """Current local time as 'YYYY-MM-DD HH:MM:SS', formatted at most once per second."""
+    global _timestamp_cache
+    now = int(time.time())
+    cached_sec, text = _timestamp_cache
+    if cached_sec != now:
+        t = time.localtime(now)
+        text = "%04d-%02d-%02d %02d:%02d:%02d" % (
+            t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec
+        )
+        _timestamp_cache = (now, text)
+    return text
+
+
+# Mismatching run numbers kept per record/response; the total is always counted.
+MAX_REPORTED_MISMATCHES = 256
+
+
+def _summarize_runs(runs_payload, hash_key, baseline):
+    """
+    One pass over the submitted run dicts. Returns (hashes, baseline,
+    unique hashes in first-seen order, the first MAX_REPORTED_MISMATCHES
+    1-based indices of hashes that differ from the baseline, total number
+    of such hashes). An empty `baseline` falls back to the first hash.
+    """
+    hashes = []
+    seen = set()
+    unique = []
+    mismatches = []
+    mismatch_count = 0
+    for run in runs_payload:
+        if not isinstance(run, dict):
+            continue
+        hash_value = run.get(hash_key)
+        if not hash_value:
+            continue
+        hashes.append(hash_value)
+        if not baseline:
+            baseline = hash_value
+        if hash_value not in seen:
+            seen.add(hash_value)
+            unique.append(hash_value)
+        if hash_value != baseline:
+            mismatch_count += 1
+            if mismatch_count <= MAX_REPORTED_MISMATCHES:
+                mismatches.append(len(hashes))
+    return hashes, baseline, unique, mismatches, mismatch_count
+
+
+def _format_runs(mismatches, mismatch_count):
+    """Comma-separated run numbers, noting any beyond the reported ones."""
+    listed = ", ".join(map(str, mismatches))
+    extra = mismatch_count - len(mismatches)
+    return f"{listed} and {extra} more" if extra else listed
+
+
 def generate_secure_password(length: int = 16) -> str:
     """Generate a random password with mixed character classes."""
-    alphabet = string.ascii_lowercase + string.ascii_uppercase + string.digits + "!@#$%^&*()-_=+[]{}"
-    specials = set("!@#$%^&*()-_=+[]{}")
     while True:
-        password = ''.join(secrets.choice(alphabet) for _ in range(length))
-        if (
-            any(c.islower() for c in password)
-            and any(c.isupper() for c in password)
-            and any(c.isdigit() for c in password)
-            and any(c in specials for c in password)
-        ):
+        # One entropy draw per attempt: bytes in the biased tail are deleted,
+        # the rest map straight onto the alphabet via the translate table.
+        raw = secrets.token_bytes(length * 2)
+        chars = raw.translate(_PASSWORD_TABLE, _PASSWORD_REJECT)[:length]
+        if len(chars) < length:
+            continue
+        password = chars.decode("ascii")
+        used = set(password)
+        if all(used & char_class for char_class in _PASSWORD_CLASSES):
             return password
 
 def open_browser():
@@ -137,41 +249,38 @@ def acquire_session():
     if not username:
         return jsonify(status='error', error="Username is required"), 400
 
+    user_key = username.lower()
     now_ts = time.time()
+    # Only read/write the session state under the lock; responses are built after.
     with _session_lock:
         _expire_session_if_needed(now_ts)
         owner = _session_state["owner"]
-        if owner and owner.lower() != username.lower():
-            acquired_at = _session_state["acquired_at"]
-            started_at = (
-                datetime.fromtimestamp(acquired_at).isoformat()
-                if acquired_at
-                else None
-            )
-            return (
-                jsonify(
-                    status="busy",
-                    owner=owner,
-                    startedAt=started_at,
-                    timeout=SESSION_TIMEOUT_SECONDS,
-                ),
-                409,
-            )
-
-        if owner and owner.lower() == username.lower():
+        if owner and _session_state["owner_key"] != user_key:
+            kind = "busy"
+            started_at = _session_state["started_at"]
+        else:
+            if not owner:
+                _session_state["owner"] = username
+                _session_state["owner_key"] = user_key
+                _session_state["token"] = secrets.token_bytes(32).hex()
+                _session_state["acquired_at"] = now_ts
+                _session_state["started_at"] = datetime.fromtimestamp(now_ts).isoformat()
             _session_state["last_heartbeat"] = now_ts
-            return jsonify(
-                status="ok",
-                token=_session_state["token"],
+            _publish_session_locked()
+            kind = "ok"
+            token = _session_state["token"]
+
+    if kind == "busy":
+        return (
+            jsonify(
+                status="busy",
+                owner=owner,
+                startedAt=started_at,
                 timeout=SESSION_TIMEOUT_SECONDS,
-            )
-
-        token = secrets.token_hex(32)
-        _session_state["owner"] = username
-        _session_state["token"] = token
-        _session_state["acquired_at"] = now_ts
-        _session_state["last_heartbeat"] = now_ts
-        return jsonify(status="ok", token=token, timeout=SESSION_TIMEOUT_SECONDS)
+            ),
+            409,
+        )
+    return jsonify(status="ok", token=token, timeout=SESSION_TIMEOUT_SECONDS)
 
 
 @app.route('/session/heartbeat', methods=['POST'])
@@ -181,19 +290,20 @@ def heartbeat_session():
     token = (data.get("token") or "").strip()
     if not username or not token:
         return jsonify(status='error', error="Username and token are required"), 400
+    user_key = username.lower()
 
     now_ts = time.time()
     with _session_lock:
         _expire_session_if_needed(now_ts)
-        owner = _session_state["owner"]
-        if (
-            owner
-            and owner.lower() == username.lower()
-            and _session_state["token"] == token
-        ):
+        active = bool(
+            _session_state["owner_key"] == user_key and _session_token_matches(token)
+        )
+        if active:
             _session_state["last_heartbeat"] = now_ts
-            return jsonify(status="ok")
+            _publish_session_locked()
 
+    if active:
+        return jsonify(status="ok")
     return jsonify(status='error', error="Session is no longer active"), 409
 
 
@@ -204,17 +314,17 @@ def release_session():
     token = (data.get("token") or "").strip()
     if not username or not token:
         return jsonify(status='error', error="Username and token are required"), 400
+    user_key = username.lower()
 
     with _session_lock:
-        owner = _session_state["owner"]
-        if (
-            owner
-            and owner.lower() == username.lower()
-            and _session_state["token"] == token
-        ):
+        released = bool(
+            _session_state["owner_key"] == user_key and _session_token_matches(token)
+        )
+        if released:
             _clear_session_locked()
-            return jsonify(status="ok")
 
+    if released:
+        return jsonify(status="ok")
     return jsonify(status='error', error="Session release rejected"), 409
 
 
@@ -225,16 +335,19 @@ def capture_fingerprint():
     ok_session, session_msg = _validate_session_owner(username)
     if not ok_session:
         return jsonify(status='error', error=session_msg), 409
+    client_ip = request.remote_addr
+    # Straight from the WSGI environ rather than the case-insensitive headers view.
+    user_agent = request.environ.get("HTTP_USER_AGENT")
     fingerprint_details = data.get("fingerprint")
-    captured_at = data.get("timestamp") or time.strftime('%Y-%m-%d %H:%M:%S')
+    captured_at = data.get("timestamp") or _local_timestamp()
 
     payload = {
         "captured_at": captured_at,
         "hash": data.get("fingerprintHash"),
         "fingerprint_string": data.get("fingerprintString"),
         "details": fingerprint_details,
-        "client_ip": request.remote_addr,
-        "user_agent": request.headers.get("User-Agent"),
+        "client_ip": client_ip,
+        "user_agent": user_agent,
     }
 
     ok, msg = store_user_fingerprint(username, payload)
@@ -252,37 +365,39 @@ def record_triangle_stability():
     ok_session, session_msg = _validate_session_owner(username)
     if not ok_session:
         return jsonify(status='error', error=session_msg), 409
+    captured_at = data.get("timestamp") or _local_timestamp()
+    client_ip = request.remote_addr
 
     user_record = get_user_record(username)
     if user_record is None:
         return jsonify(status='error', error="User does not exist"), 404
 
-    runs_payload = data.get("testRuns") or []
-    hashes = [run.get("hash") for run in runs_payload if isinstance(run, dict) and run.get("hash")]
-    if not hashes:
-        return jsonify(status='error', error="Missing valid hash data"), 400
-
     # Determine baseline: prefer existing user baseline; otherwise use client provided baseline or first hash
     stored_baseline = (user_record.get("triangle_baseline") or "").strip()
     client_baseline = (data.get("baselineHash") or data.get("localBaseline") or "").strip()
-    baseline_used = stored_baseline or client_baseline or hashes[0]
+    runs_payload = data.get("testRuns") or []
+    hashes, baseline_used, unique_hashes, mismatches, mismatch_count = _summarize_runs(
+        runs_payload, "hash", stored_baseline or client_baseline
+    )
+    if not hashes:
+        return jsonify(status='error', error="Missing valid hash data"), 400
 
     if not stored_baseline:
         set_triangle_baseline(username, baseline_used)
 
-    mismatches = [idx + 1 for idx, hash_value in enumerate(hashes) if hash_value != baseline_used]
-    all_stable = len(mismatches) == 0
+    all_stable = mismatch_count == 0
 
     record = {
-        "captured_at": data.get("timestamp") or time.strftime('%Y-%m-%d %H:%M:%S'),
+        "captured_at": captured_at,
         "seed": data.get("seed"),
         "baseline_hash": baseline_used,
         "all_stable": all_stable,
-        "unique_hashes": list(dict.fromkeys(hashes)),  # preserve order
+        "unique_hashes": unique_hashes,
         "runs": runs_payload,
         "hashes": hashes,
         "mismatch_runs": mismatches,
-        "client_ip": request.remote_addr,
+        "mismatch_count": mismatch_count,
+        "client_ip": client_ip,
     }
 
     ok, msg = append_triangle_stability(username, record)
@@ -290,17 +405,18 @@ def record_triangle_stability():
         alert_message = (
             f"Rendering stable: all {len(hashes)} hashes matched the baseline {baseline_used}."
             if all_stable
-            else f"Inconsistencies detected: runs {', '.join(map(str, mismatches))} deviated from baseline {baseline_used}."
+            else f"Inconsistencies detected: runs {_format_runs(mismatches, mismatch_count)} deviated from baseline {baseline_used}."
         )
         response = {
             "status": "ok",
             "baselineHash": baseline_used,
             "allStable": all_stable,
             "mismatchRuns": mismatches,
+            "mismatchCount": mismatch_count,
             "totalRuns": len(hashes),
             "alertMessage": alert_message,
         }
-        return jsonify(response)
+        return json_response(response)
     return jsonify(status='error', error=msg), 400
 
 
@@ -315,50 +431,44 @@ def record_audio_stability():
     ok_session, session_msg = _validate_session_owner(username)
     if not ok_session:
         return jsonify(status='error', error=session_msg), 409
+    captured_at = data.get("timestamp") or _local_timestamp()
+    client_ip = request.remote_addr
 
     user_record = get_user_record(username)
     if user_record is None:
         return jsonify(status='error', error="User does not exist"), 404
 
-    runs_payload = data.get("testRuns") or []
-    hashes = [
-        run.get("waveformHash")
-        for run in runs_payload
-        if isinstance(run, dict) and run.get("waveformHash")
-    ]
-    if not hashes:
-        return jsonify(status='error', error="Missing valid hash data"), 400
-
     stored_baseline = (user_record.get("audio_baseline") or "").strip()
     client_baseline = (
         data.get("baselineHash")
         or data.get("localBaseline")
         or ""
     ).strip()
-    baseline_used = stored_baseline or client_baseline or hashes[0]
+    runs_payload = data.get("testRuns") or []
+    hashes, baseline_used, unique_hashes, mismatches, mismatch_count = _summarize_runs(
+        runs_payload, "waveformHash", stored_baseline or client_baseline
+    )
+    if not hashes:
+        return jsonify(status='error', error="Missing valid hash data"), 400
 
     if not stored_baseline:
         set_audio_baseline(username, baseline_used)
 
-    mismatches = [
-        idx + 1
-        for idx, hash_value in enumerate(hashes)
-        if hash_value != baseline_used
-    ]
-    all_stable = len(mismatches) == 0
+    all_stable = mismatch_count == 0
 
     record = {
-        "captured_at": data.get("timestamp") or time.strftime('%Y-%m-%d %H:%M:%S'),
+        "captured_at": captured_at,
         "session_id": data.get("sessionId"),
         "baseline_hash": baseline_used,
         "all_stable": all_stable,
-        "unique_hashes": list(dict.fromkeys(hashes)),
+        "unique_hashes": unique_hashes,
         "runs": runs_payload,
         "hashes": hashes,
         "mismatch_runs": mismatches,
+        "mismatch_count": mismatch_count,
         "stability_rate": data.get("stabilityRate"),
         "total_runs": len(hashes),
-        "client_ip": request.remote_addr,
+        "client_ip": client_ip,
     }
 
     ok, msg = append_audio_stability(username, record)
@@ -366,17 +476,18 @@ def record_audio_stability():
         alert_message = (
             f"Audio hashes stable: all {len(hashes)} hashes matched the baseline {baseline_used}."
             if all_stable
-            else f"Audio test detected inconsistencies: runs {', '.join(map(str, mismatches))} deviated from baseline {baseline_used}."
+            else f"Audio test detected inconsistencies: runs {_format_runs(mismatches, mismatch_count)} deviated from baseline {baseline_used}."
         )
         response = {
             "status": "ok",
             "baselineHash": baseline_used,
             "allStable": all_stable,
             "mismatchRuns": mismatches,
+            "mismatchCount": mismatch_count,
             "totalRuns": len(hashes),
             "alertMessage": alert_message,
         }
-        return jsonify(response)
+        return json_response(response)
     return jsonify(status='error', error=msg), 400
 
 
@@ -389,21 +500,14 @@ def record_canvas_stability():
     ok_session, session_msg = _validate_session_owner(username)
     if not ok_session:
         return jsonify(status='error', error=session_msg), 409
+    captured_at = data.get("timestamp") or _local_timestamp()
+    client_ip = request.remote_addr
 
     user_record = get_user_record(username)
     if user_record is None:
         return jsonify(status='error', error="User does not exist"), 404
 
     seed = (data.get("seed") or "").strip()
-    runs_payload = data.get("testRuns") or []
-    hashes = [
-        run.get("hash")
-        for run in runs_payload
-        if isinstance(run, dict) and run.get("hash")
-    ]
-    if not hashes:
-        return jsonify(status='error', error="Missing valid hash data"), 400
-
     raw_baseline = user_record.get("canvas_baseline")
     if isinstance(raw_baseline, dict):
         stored_baseline = (raw_baseline.get(seed) or raw_baseline.get("__default__") or "").strip()
@@ -414,28 +518,29 @@ def record_canvas_stability():
         or data.get("localBaseline")
         or ""
     ).strip()
-    baseline_used = stored_baseline or client_baseline or hashes[0]
+    runs_payload = data.get("testRuns") or []
+    hashes, baseline_used, unique_hashes, mismatches, mismatch_count = _summarize_runs(
+        runs_payload, "hash", stored_baseline or client_baseline
+    )
+    if not hashes:
+        return jsonify(status='error', error="Missing valid hash data"), 400
 
     if not stored_baseline:
         set_canvas_baseline(username, seed, baseline_used)
 
-    mismatches = [
-        idx + 1
-        for idx, hash_value in enumerate(hashes)
-        if hash_value != baseline_used
-    ]
-    all_stable = len(mismatches) == 0
+    all_stable = mismatch_count == 0
 
     record = {
-        "captured_at": data.get("timestamp") or time.strftime('%Y-%m-%d %H:%M:%S'),
+        "captured_at": captured_at,
         "seed": data.get("seed"),
         "baseline_hash": baseline_used,
         "all_stable": all_stable,
-        "unique_hashes": list(dict.fromkeys(hashes)),
+        "unique_hashes": unique_hashes,
         "runs": runs_payload,
         "hashes": hashes,
         "mismatch_runs": mismatches,
-        "client_ip": request.remote_addr,
+        "mismatch_count": mismatch_count,
+        "client_ip": client_ip,
     }
 
     config_meta = data.get("drawConfig")
@@ -447,17 +552,18 @@ def record_canvas_stability():
         alert_message = (
             f"Canvas rendering stable: all {len(hashes)} hashes matched the baseline {baseline_used}."
             if all_stable
-            else f"Canvas test detected inconsistencies: runs {', '.join(map(str, mismatches))} deviated from baseline {baseline_used}."
+            else f"Canvas test detected inconsistencies: runs {_format_runs(mismatches, mismatch_count)} deviated from baseline {baseline_used}."
         )
         response = {
             "status": "ok",
             "baselineHash": baseline_used,
             "allStable": all_stable,
             "mismatchRuns": mismatches,
+            "mismatchCount": mismatch_count,
             "totalRuns": len(hashes),
             "alertMessage": alert_message,
         }
-        return jsonify(response)
+        return json_response(response)
     return jsonify(status='error', error=msg), 400
 
 
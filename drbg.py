@@ -1,10 +1,35 @@
-import hmac
 import hashlib
+import threading
 import flask
-from typing import Optional
+import numpy as np
+from typing import List, Optional
 from flask import jsonify
 import os, struct
 from datetime import datetime
+from functools import lru_cache
+
+# HMAC key-pad translation tables (RFC 2104): byte -> byte ^ 0x36 / byte ^ 0x5c.
+_IPAD = bytes(x ^ 0x36 for x in range(256))
+_OPAD = bytes(x ^ 0x5C for x in range(256))
+_BLOCK_SIZE = 64  # SHA-256 block size in bytes
+_U64 = struct.Struct("<Q")
+
+# Instantiate starts every DRBG from the same K = 0x00.., V = 0x01.. state.
+_K0 = b"\x00" * 32
+_V0 = b"\x01" * 32
+_K0_OUTER = hashlib.sha256(_K0.ljust(_BLOCK_SIZE, b"\x00").translate(_OPAD))
+
+
+@lru_cache(maxsize=64)
+def _instantiate_prefix(entropy_input: bytes):
+    """
+    Inner HMAC(K0, .) state after absorbing V0 || 0x00 || entropy_input.
+    Callers only vary nonce/personalization per instance, so the first
+    Update round resumes from here instead of rehashing the constant prefix.
+    """
+    inner = hashlib.sha256(_K0.ljust(_BLOCK_SIZE, b"\x00").translate(_IPAD))
+    inner.update(_V0 + b"\x00" + entropy_input)
+    return inner
 
 
 class HMACDRBG:
@@ -13,9 +38,16 @@ class HMACDRBG:
     - Instantiate(entropy_input, nonce, personalization_string)
     - Reseed(entropy_input, additional_input)
     - Generate(n_bytes, additional_input)
-    Also exposes randint(a, b) with rejection sampling (uniform, no modulo bias).
+    Also exposes randint(a, b) with rejection sampling (uniform, no modulo bias)
+    and randints(a, b, count) for batched draws.
     """
 
+    # Bytes fetched per Generate call when refilling the randint/uniform buffer:
+    # starts small so short-lived instances hash only what they use, and
+    # doubles on each refill up to the cap for long streams.
+    _DRAW_CHUNK_MIN = 64
+    _DRAW_CHUNK = 4096
+
     def __init__(
         self,
         entropy_input: bytes,
@@ -25,31 +57,90 @@ class HMACDRBG:
     ):
         self._hash = hashlib.sha256
         self._outlen = self._hash().digest_size  # 32 bytes for SHA-256
-        # 10.1.2.3 Instantiate Process
-        self.K = b"\x00" * self._outlen
-        self.V = b"\x01" * self._outlen
+        # 10.1.2.3 Instantiate Process: Update(seed_material) from (K0, V0),
+        # with the first K = HMAC(K0, V0 || 0x00 || seed_material) resumed
+        # from the cached state covering the entropy prefix.
         seed_material = entropy_input + nonce + personalization_string
-        self._update(seed_material)
+        inner = _instantiate_prefix(bytes(entropy_input)).copy()
+        inner.update(nonce + personalization_string)
+        outer = _K0_OUTER.copy()
+        outer.update(inner.digest())
+        self.K = outer.digest()
+        self.V = self._hmac(_V0)
+        if seed_material:
+            self.K = self._hmac(self.V + b"\x01" + seed_material)
+            self.V = self._hmac(self.V)
         self.reseed_counter = 1
         self.reseed_interval = reseed_interval
+        self._buf = b""
+        self._buf_pos = 0
+        self._draw_chunk = self._DRAW_CHUNK_MIN
+
+    @property
+    def K(self) -> bytes:
+        return self._K
+
+    @K.setter
+    def K(self, key: bytes):
+        # Hash the ipad/opad key blocks once per key; every HMAC under this K
+        # then resumes from copies of those SHA-256 states.
+        padded = key.ljust(_BLOCK_SIZE, b"\x00")  # K is 32 bytes, never hashed down
+        self._inner_mid = self._hash(padded.translate(_IPAD))
+        self._outer_mid = self._hash(padded.translate(_OPAD))
+        self._K = key
 
     # --- Internal helpers (spec 10.1.2.2 Update Function) ---
-    def _hmac(self, key: bytes, data: bytes) -> bytes:
-        return hmac.new(key, data, self._hash).digest()
+    def _hmac(self, data: bytes) -> bytes:
+        """HMAC-SHA256 of `data` under the current K."""
+        inner = self._inner_mid.copy()
+        inner.update(data)
+        outer = self._outer_mid.copy()
+        outer.update(inner.digest())
+        return outer.digest()
 
     def _update(self, provided_data: Optional[bytes]):
         # K = HMAC(K, V || 0x00 || provided_data)
         # V = HMAC(K, V)
         if provided_data is None:
             provided_data = b""
-        self.K = self._hmac(self.K, self.V + b"\x00" + provided_data)
-        self.V = self._hmac(self.K, self.V)
+        self.K = self._hmac(self.V + b"\x00" + provided_data)
+        self.V = self._hmac(self.V)
 
         if len(provided_data) > 0:
             # K = HMAC(K, V || 0x01 || provided_data)
             # V = HMAC(K, V)
-            self.K = self._hmac(self.K, self.V + b"\x01" + provided_data)
-            self.V = self._hmac(self.K, self.V)
+            self.K = self._hmac(self.V + b"\x01" + provided_data)
+            self.V = self._hmac(self.V)
+
+    def _refill(self, n: int):
+        # Refills are whole blocks and Generate has no post-update here, so
+        # the buffered bytes match one long Generate call. Draws that divide
+        # every refill size (randint's 8 bytes) therefore do not depend on
+        # the refill schedule; others (random_float's 7 bytes) drop the
+        # buffer's tail at each refill, so their sequence does.
+        self._buf = self.generate(max(n, self._draw_chunk))
+        self._buf_pos = 0
+        self._draw_chunk = min(self._draw_chunk * 2, self._DRAW_CHUNK)
+
+    def _draw(self, n: int) -> bytes:
+        """
+        Return the next `n` bytes of the randint/uniform buffer, refilling it
+        with one large Generate call when it runs dry.
+        """
+        if self._buf_pos + n > len(self._buf):
+            self._refill(n)
+        start = self._buf_pos
+        self._buf_pos = start + n
+        return self._buf[start : self._buf_pos]
+
+    def _draw_u64(self) -> int:
+        # Same bytes as int.from_bytes(self._draw(8), "little"), without the slice.
+        pos = self._buf_pos
+        if pos + 8 > len(self._buf):
+            self._refill(8)
+            pos = 0
+        self._buf_pos = pos + 8
+        return _U64.unpack_from(self._buf, pos)[0]
 
     # --- Public API ---
 
@@ -60,6 +151,9 @@ class HMACDRBG:
         seed_material = entropy_input + additional_input
         self._update(seed_material)
         self.reseed_counter = 1
+        # Buffered bytes predate the new entropy; don't hand them out.
+        self._buf = b""
+        self._buf_pos = 0
 
     def generate(self, n_bytes: int, additional_input: bytes = b"") -> bytes:
         """
@@ -73,22 +167,37 @@ class HMACDRBG:
             )
 
         if additional_input:
+            # Later draws must reflect the mixed-in input, so drop buffered bytes.
+            self._buf = b""
+            self._buf_pos = 0
             # K = HMAC(K, V || 0x00 || additional_input); V = HMAC(K, V)
-            self.K = self._hmac(self.K, self.V + b"\x00" + additional_input)
-            self.V = self._hmac(self.K, self.V)
-
-        # Produce pseudorandom bytes
-        temp = bytearray()
-        while len(temp) < n_bytes:
-            self.V = self._hmac(self.K, self.V)
-            temp += self.V
-
-        returned_bits = bytes(temp[:n_bytes])
+            self.K = self._hmac(self.V + b"\x00" + additional_input)
+            self.V = self._hmac(self.V)
+
+        # Produce pseudorandom bytes: V = HMAC(K, V) per block, with the HMAC
+        # inlined against K's midstates so the loop makes no Python calls.
+        # Collect whole blocks and join once: one exact-size allocation, and
+        # block-aligned requests (the usual case) need no trimming copy.
+        inner_mid, outer_mid = self._inner_mid, self._outer_mid
+        V = self.V
+        blocks = []
+        for _ in range(-(-n_bytes // self._outlen)):
+            inner = inner_mid.copy()
+            inner.update(V)
+            outer = outer_mid.copy()
+            outer.update(inner.digest())
+            V = outer.digest()
+            blocks.append(V)
+        self.V = V
+
+        returned_bits = b"".join(blocks)
+        if len(returned_bits) != n_bytes:
+            returned_bits = returned_bits[:n_bytes]
 
         if additional_input:
             # Post-generation update (if additional_input provided)
-            self.K = self._hmac(self.K, self.V + b"\x00" + additional_input)
-            self.V = self._hmac(self.K, self.V)
+            self.K = self._hmac(self.V + b"\x00" + additional_input)
+            self.V = self._hmac(self.V)
 
         self.reseed_counter += 1
         return returned_bits
@@ -97,37 +206,65 @@ class HMACDRBG:
 
     def randint(self, a: int, b: int) -> int:
         """
-        Returns a uniform integer in [a, b] using rejection sampling (no modulo bias).
+        Returns a uniform integer in [a, b] without modulo bias.
+        Spans up to 2^64 use Lemire's multiply-shift on a 64-bit draw, rejecting
+        only the few low products that would bias the result; wider spans fall
+        back to byte-wise rejection sampling.
         """
         if a > b:
             raise ValueError("a must be <= b")
         span = b - a + 1
-        if span <= 0:
-            # Shouldn't happen for finite ints, but just in case
-            raise ValueError("Invalid span")
-
-        # Determine how many bytes we need to cover the span
-        # We draw k bytes => 0..(2^(8k)-1). Accept if within limit, else retry.
-        # limit = floor((2^(8k) / span)) * span - 1
-        # Choose smallest k such that 2^(8k) >= span
-        k = 1
-        while (1 << (8 * k)) < span:
-            k += 1
-
-        space = 1 << (8 * k)
-        limit = (space // span) * span - 1
-
+        if span > (1 << 64):
+            return a + self._randbelow_wide(span)
+
+        m = self._draw_u64() * span
+        if (m & 0xFFFFFFFFFFFFFFFF) < span:
+            threshold = (1 << 64) % span
+            while (m & 0xFFFFFFFFFFFFFFFF) < threshold:
+                m = self._draw_u64() * span
+        return a + (m >> 64)
+
+    def _randbelow_wide(self, span: int) -> int:
+        # Draw k bytes => 0..(2^(8k)-1) with 2^(8k) >= span. Accept if within
+        # limit = floor(2^(8k) / span) * span - 1, else retry.
+        k = (span.bit_length() + 7) // 8
+        limit = ((1 << (8 * k)) // span) * span - 1
         while True:
-            r = int.from_bytes(self.generate(k), "big")
+            r = int.from_bytes(self._draw(k), "big")
             if r <= limit:
-                return a + (r % span)
+                return r % span
+
+    def randints(self, a: int, b: int, count: int) -> List[int]:
+        """
+        Returns `count` uniform integers in [a, b] drawn from one Generate call.
+        Each 32-bit word is mapped with Lemire's multiply-shift; the rare words
+        falling in the biased low region are rejected and redrawn.
+        """
+        if a > b:
+            raise ValueError("a must be <= b")
+        if count <= 0:
+            return []
+        span = b - a + 1
+        if span > (1 << 32):
+            return [self.randint(a, b) for _ in range(count)]
+
+        threshold = (1 << 32) % span
+        values = np.empty(0, dtype=np.uint64)
+        while values.size < count:
+            words = np.frombuffer(
+                self.generate(4 * (count - values.size)), dtype="<u4"
+            ).astype(np.uint64)
+            products = words * np.uint64(span)
+            accepted = products[(products & np.uint64(0xFFFFFFFF)) >= threshold]
+            values = np.concatenate((values, accepted >> np.uint64(32)))
+        return (values[:count].astype(np.int64) + a).tolist()
 
     def random_float(self) -> float:
         """
         Return a uniform float in [0.0, 1.0) with 53 bits of precision.
         """
         # 7 bytes = 56 bits; we only need 53
-        raw = int.from_bytes(self.generate(7), "big")
+        raw = int.from_bytes(self._draw(7), "big")
         x = raw >> 3  # discard 3 high bits
         return x / (1 << 53)
 
@@ -141,6 +278,27 @@ class HMACDRBG:
         return self.generate(n)
 
 
+class SharedHMACDRBG:
+    """
+    Process-wide HMACDRBG for values that must be unpredictable but need not be
+    reproducible per seed (e.g. per-request layout positions). One long-lived
+    instance avoids re-running Instantiate on every request. Calls are
+    serialised by a lock and the state is reseeded from os.urandom every
+    `reseed_every` Generate calls.
+    """
+
+    def __init__(self, entropy_input: bytes, reseed_every: int = 2**16):
+        self._drbg = HMACDRBG(entropy_input=entropy_input, nonce=os.urandom(16))
+        self._lock = threading.Lock()
+        self._reseed_every = reseed_every
+
+    def randints(self, a: int, b: int, count: int) -> List[int]:
+        with self._lock:
+            if self._drbg.reseed_counter > self._reseed_every:
+                self._drbg.reseed(os.urandom(32))
+            return self._drbg.randints(a, b, count)
+
+
 # -------------------------------
 # Example usage
 # -------------------------------
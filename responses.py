@@ -0,0 +1,13 @@
+import flask
+import orjson
+
+# Browsers may reuse the blueprint landing pages for this long without revalidating.
+INDEX_MAX_AGE_SECONDS = 300
+
+
+def json_response(payload) -> flask.Response:
+    """Encode `payload` with orjson, serialising NumPy arrays natively."""
+    return flask.Response(
+        orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+        mimetype="application/json",
+    )
@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import User_Manager.user_manager as um
+
+
+class UserManagerTestCase(unittest.TestCase):
+    """Points user_manager at a scratch directory with empty caches."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.users_dir = os.path.join(self.tmp, "users")
+        os.makedirs(self.users_dir)
+        self._saved = {
+            name: getattr(um, name)
+            for name in ("DATA_DIR", "USERS_DIR", "STABILITY_DB_PATH")
+        }
+        um.DATA_DIR = self.tmp
+        um.USERS_DIR = self.users_dir
+        um.STABILITY_DB_PATH = os.path.join(self.tmp, "stability.db")
+        um._user_cache.clear()
+        um._pending_writes.clear()
+        um._pending_mutators.clear()
+        um._name_index.clear()
+        um._name_index_mtime = None
+
+    def tearDown(self):
+        um.flush_pending_writes()
+        um._user_cache.clear()
+        for name, value in self._saved.items():
+            setattr(um, name, value)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def user_path(self, username):
+        return os.path.join(self.users_dir, f"{username}.json")
+
+    def write_legacy(self, username, record):
+        """Write a user file the way the json.dump based storage did."""
+        with open(self.user_path(username), "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+
+    def read_file(self, username):
+        with open(self.user_path(username), encoding="utf-8") as f:
+            return json.load(f)
+
+
+class LegacyFileTests(UserManagerTestCase):
+    def test_wide_int_survives_load_and_rewrite(self):
+        wide = 1180591620717411303424  # 2**70
+        self.write_legacy("Fay", {"username": "Fay", "counter": wide})
+
+        self.assertEqual(um.get_user_record("Fay")["counter"], wide)
+        self.assertEqual(um.store_system_timing("Fay", {"total_ms": 1}), (True, "ok"))
+        self.assertEqual(self.read_file("Fay")["counter"], wide)
+
+    def test_get_user_record_copies_wide_int_records(self):
+        wide = 1180591620717411303424
+        self.write_legacy("Fay", {"username": "Fay", "runs": [{"n": wide}]})
+
+        first = um.get_user_record("Fay")  # orjson cannot encode it: deepcopy path
+        first["runs"][0]["n"] = 0
+        self.assertEqual(um.get_user_record("Fay")["runs"][0]["n"], wide)
+
+    def test_nan_file_still_loads(self):
+        self.write_legacy("Fay", {"username": "Fay", "score": float("nan")})
+
+        record = um.get_user_record("Fay")
+        self.assertIsNotNone(record)
+        self.assertEqual(record["username"], "Fay")
+
+    def test_rejects_payload_orjson_cannot_store(self):
+        self.write_legacy("Fay", {"username": "Fay"})
+
+        ok, _ = um.append_triangle_stability("Fay", {"hash": "h", "n": 2**70})
+        self.assertFalse(ok)
+
+
+class DeferredAppendTests(UserManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        # Keep the background writer out of the way; tests flush explicitly.
+        self._batch_delay = um.WRITE_BATCH_DELAY
+        um.WRITE_BATCH_DELAY = 60
+
+    def tearDown(self):
+        um.WRITE_BATCH_DELAY = self._batch_delay
+        super().tearDown()
+
+    def test_appends_are_flushed(self):
+        self.write_legacy("Fay", {"username": "Fay"})
+        for i in range(3):
+            self.assertEqual(um.append_triangle_stability("Fay", {"run": i}), (True, "ok"))
+        self.assertNotIn("triangle_stability", self.read_file("Fay"))
+
+        um.flush_pending_writes()
+        self.assertEqual(
+            [r["run"] for r in self.read_file("Fay")["triangle_stability"]], [0, 1, 2]
+        )
+
+    def test_outside_edit_before_flush_keeps_queued_appends(self):
+        self.write_legacy("Fay", {"username": "Fay"})
+        for i in range(3):
+            self.assertEqual(um.append_triangle_stability("Fay", {"run": i}), (True, "ok"))
+
+        edited = self.read_file("Fay")
+        edited["note"] = "edited by hand"
+        self.write_legacy("Fay", edited)
+        um.flush_pending_writes()
+
+        for record in (um.get_user_record("Fay"), self.read_file("Fay")):
+            self.assertEqual(record["note"], "edited by hand")
+            self.assertEqual([r["run"] for r in record["triangle_stability"]], [0, 1, 2])
+
+    def test_outside_edit_then_more_appends(self):
+        self.write_legacy("Fay", {"username": "Fay"})
+        um.append_audio_stability("Fay", {"run": 0})
+        edited = self.read_file("Fay")
+        edited["note"] = "edited by hand"
+        self.write_legacy("Fay", edited)
+        um.append_audio_stability("Fay", {"run": 1})
+        um.flush_pending_writes()
+
+        record = self.read_file("Fay")
+        self.assertEqual(record["note"], "edited by hand")
+        self.assertEqual([r["run"] for r in record["audio_stability"]], [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()